@@ -39,6 +39,7 @@ if "bpy" in locals():
     imp.reload(swg_types)
     imp.reload(vector3D)
     imp.reload(vertex_buffer_format)
+    imp.reload(vertex_cache)
 else:    
     from . import iff_tools
     from . import mgn_tools
@@ -47,6 +48,7 @@ else:
     from . import swg_types
     from . import vector3D
     from . import vertex_buffer_format
+    from . import vertex_cache
 
 import bpy
 
@@ -54,6 +56,7 @@ import bpy
 from bpy.props import (
         BoolProperty,
         FloatProperty,
+        IntProperty,
         StringProperty,
         EnumProperty,
         )
@@ -138,6 +141,14 @@ class ExportMGN(bpy.types.Operator, ExportHelper):
             )
 
     do_tangents : BoolProperty(name='DOT3', description="Include DOT3 tangent vectors.", default=True) 
+    do_weld : BoolProperty(name='Weld', description="Share vertices whose position, normal, UV and tangent match.", default=True)
+    weld_epsilon : FloatProperty(name='Weld Epsilon', description="How far normals, UVs and tangents may differ and still be welded. 0 welds exact matches only.", default=0.0001, min=0.0, precision=6)
+    pool_tolerance : FloatProperty(name='Pool Tolerance', description="How close normals and tangents must be to share one NORM/DOT3 entry. 0 shares exact matches only.", default=0.0001, min=0.0, precision=6)
+    blend_epsilon : FloatProperty(name='Blend Epsilon', description="Blend shape position, normal and tangent offsets no bigger than this are not exported.", default=0.00001, min=0.0, precision=6)
+    max_influences : IntProperty(name='Max Influences', description="Most bones that may influence one vertex; the weakest are dropped. 0 keeps all.", default=4, min=0)
+    weight_threshold : FloatProperty(name='Weight Threshold', description="Bone weights below this are dropped. A vertex always keeps its strongest bone.", default=0.001, min=0.0, max=1.0, precision=4)
+    palette_limit : IntProperty(name='Palette Limit', description="Split shaders whose triangles use more bones than this into several. 0 leaves them whole.", default=0, min=0)
+    do_vertex_cache : BoolProperty(name='Vertex Cache', description="Reorder triangles and vertices for the GPU vertex cache.", default=False)
     
     def execute(self, context):
         from . import mgnexport
@@ -173,6 +184,14 @@ class MGN_PT_export_option(bpy.types.Panel):
         sfile = context.space_data
         operator = sfile.active_operator
         layout.prop(operator, 'do_tangents')
+        layout.prop(operator, 'do_weld')
+        layout.prop(operator, 'weld_epsilon')
+        layout.prop(operator, 'pool_tolerance')
+        layout.prop(operator, 'blend_epsilon')
+        layout.prop(operator, 'max_influences')
+        layout.prop(operator, 'weight_threshold')
+        layout.prop(operator, 'palette_limit')
+        layout.prop(operator, 'do_vertex_cache')
 
 def mgn_import(self, context):
     self.layout.operator(ImportMGN.bl_idname, text="SWG Animated Mesh (.mgn)")
@@ -21,10 +21,18 @@
 # Option OZN & ZTO: export Occlusions. See Readme.
 # Option Skeleton:  name of the skeleton file without extention. See Readme.
 # Option OITL:  Export OITL instead of ITL. See Readme.
+# Option Weld: Share PSDT vertices that match within the weld epsilon.
+# Option Pool Tolerance: How close normals/tangents must be to share a NORM/DOT3 entry.
+# Option Blend Epsilon: Smallest blend offset exported; smaller ones are dropped.
+# Option Max Influences: Most bones kept per vertex, strongest first. 0 keeps all.
+# Option Weight Threshold: Bone weights below this are dropped before renormalizing.
+# Option Palette Limit: Split shaders so none uses more bones than this. 0 disables.
+# Option Vertex Cache: Reorder triangles and vertices for the GPU vertex cache.
 # ##############################################################################
 import bpy, mathutils, struct, os, collections, array
 import time, datetime
 import bmesh
+import numpy
 from bpy.props import *
 from mathutils import Vector
 from . import swg_types, mgn_tools
@@ -39,10 +47,33 @@ def mesh_triangulate(me):
     bm.to_mesh(me)
     bm.free()
 
+def to_swg_space(vectors):
+    # Blender (x, y, z) -> SWG (-x, z, -y) for an (N,3) array
+    return vectors[:, [0, 2, 1]] * numpy.array([-1, 1, -1], dtype=vectors.dtype)
+
+def moved_rows(new, old, epsilon):
+    # (indices, SWG space deltas) of the rows of new that differ from old by more than epsilon
+    delta = to_swg_space(new - old)
+    moved = numpy.flatnonzero(numpy.abs(delta).max(axis=1) > epsilon) if len(delta) > 0 else numpy.zeros(0, dtype=numpy.int64)
+    return moved.astype(numpy.int32), delta[moved].astype(numpy.float32)
+
+def read_vectors(collection, attribute, count):
+    values = numpy.zeros(count * 3, dtype=numpy.float32)
+    collection.foreach_get(attribute, values)
+    return values.reshape(-1, 3)
+
 def export_mgn(context, 
                filepath, 
                *,
-               do_tangents = True):    
+               do_tangents = True,
+               do_weld = True,
+               weld_epsilon = 0.0001,
+               pool_tolerance = 0.0001,
+               blend_epsilon = 0.00001,
+               max_influences = 4,
+               weight_threshold = 0.001,
+               palette_limit = 0,
+               do_vertex_cache = False):    
     starttime = time.time()
 
     current_obj = None
@@ -60,30 +91,33 @@ def export_mgn(context,
                 current_obj = ob
                 
     bm = current_obj.to_mesh() 
-    mesh_triangulate(bm)
+    loop_totals = numpy.zeros(len(bm.polygons), dtype=numpy.int32)
+    bm.polygons.foreach_get("loop_total", loop_totals)
+    if do_tangents and len(loop_totals) > 0 and loop_totals.max() > 4:
+        # calc_tangents only handles tris and quads, everything else reads bm.loop_triangles
+        print(f"Mesh has ngons, triangulating for tangents")
+        mesh_triangulate(bm)
     
     bm.calc_normals_split()
-
-    t_ln = array.array(data_types.ARRAY_FLOAT64, (0.0,)) * len(bm.loops) * 3
-    bm.loops.foreach_get("normal", t_ln)
-    normals = list(map(list, zip(*[iter(t_ln)]*3)))
-    
-    tang_lib = []
-    tangents=[]
-    if do_tangents:
-        t_ln = array.array(data_types.ARRAY_FLOAT64, [0.0,]) * len(bm.loops) * 3
-        uv_names = [uvlayer.name for uvlayer in bm.uv_layers]
-        for name in uv_names:
-            print(f"Did tangents for UV map: {name}")
-            bm.calc_tangents(uvmap=name)
-        for idx, uvlayer in enumerate(bm.uv_layers):
-            name = uvlayer.name
-            bm.loops.foreach_get("tangent", t_ln)  
-            tangents = list(map(list, zip(*[iter(t_ln)]*3)))
-
-        for t in tangents:
-            t.insert(3, 1.0)
-            tang_lib.append(t)
+    num_verts = len(bm.vertices)
+    num_loops = len(bm.loops)
+    vertex_co = read_vectors(bm.vertices, "co", num_verts)
+    loop_normals = read_vectors(bm.loops, "normal", num_loops)
+
+    # only the UV map that is exported needs tangents
+    uv_active = bm.uv_layers.active
+    loop_uvs = numpy.zeros(num_loops * 2, dtype=numpy.float32)
+    if uv_active is not None:
+        uv_active.data.foreach_get("uv", loop_uvs)
+    loop_uvs = loop_uvs.reshape(-1, 2)
+
+    tangent_uv = uv_active.name if do_tangents and uv_active is not None else None
+    if tangent_uv:
+        print(f"Did tangents for UV map: {tangent_uv}")
+        bm.calc_tangents(uvmap=tangent_uv)
+        loop_tangents = read_vectors(bm.loops, "tangent", num_loops)
+        bitangent_signs = numpy.zeros(num_loops, dtype=numpy.float32)
+        bm.loops.foreach_get("bitangent_sign", bitangent_signs)
 
     mgn = swg_types.SWGMgn(filepath)
 
@@ -97,108 +131,95 @@ def export_mgn(context,
             mgn.occlusions.append([key, i, current_obj[key]])
             i += 1
 
-    for vert in bm.vertices:
-        mgn.positions.append([-vert.co[0],vert.co[2],-vert.co[1]])
-
-    for normal in normals:
-        mgn.normals.append([-normal[0], normal[2], -normal[1]])
-
-    if do_tangents:
-        mgn.dot3=[]
-        for i, loop in enumerate(bm.loops):
-            tang = loop.tangent
-            mgn.dot3.append([ -tang[0], tang[2], -tang[1], loop.bitangent_sign])
-
-    twhd = []
-    twdt = []
-    for keys in bpy.data.shape_keys:
-        if keys == bm.shape_keys:
-            for key in keys.key_blocks[1:]:
-
-                blt = swg_types.SWGBLendShape()
-                blt.name = key.name
-                blt.dot3 = []
-                basis = keys.key_blocks[0].data
-                for j, kv in enumerate(key.data):
-                    delta = kv.co - basis[j].co
-                    #if delta[0] != 0 and delta[1] != 0 and delta[2] != 0:
-                    blt.positions.append([j, [-delta[0], delta[2], -delta[1]]])
-                    blt.normals.append([j, [0,0,0]])
-                    if do_tangents:
-                        blt.dot3.append([j, [0,0,0]])
-                mgn.blends.append(blt)
-            
-    face_index_pairs = [(face, index) for index, face in enumerate(bm.polygons)]
-    faces_by_material = {}
-    for f, f_index in face_index_pairs:
-        if not f.material_index in faces_by_material:
-            faces_by_material[f.material_index] = []   
-        faces_by_material[f.material_index].append(f)
-
-    uv_layer = bm.uv_layers.active.data[:]
-    for material_index in faces_by_material:
-        last_tri_index = None
-        running_tri_index = 0
-        faces = faces_by_material[material_index]
+    mgn.positions = to_swg_space(vertex_co)
+    mgn.normals = to_swg_space(loop_normals)
+    if tangent_uv:
+        mgn.dot3 = numpy.hstack((to_swg_space(loop_tangents), bitangent_signs[:, None]))
+
+    # Blends: the triangulated mesh is re-evaluated at every key's shape so the NORM and DOT3
+    # deltas are real, indexed like the per loop normal/tangent pools above
+    shape_keys = current_obj.data.shape_keys
+    if shape_keys is not None and len(shape_keys.key_blocks) > 1 and len(shape_keys.key_blocks[0].data) != num_verts:
+        print(f"*** WARNING *** Basis shape key has {len(shape_keys.key_blocks[0].data)} verts, mesh has {num_verts}. Skipping blends!")
+    elif shape_keys is not None and len(shape_keys.key_blocks) > 1:
+        # deltas are measured from the basis key's shape, not from the evaluated mesh, which
+        # modifiers or a non basis active key can move
+        basis_co = read_vectors(shape_keys.key_blocks[0].data, "co", num_verts)
+        bm.vertices.foreach_set("co", basis_co.reshape(-1))
+        bm.update()
+        bm.calc_normals_split()
+        basis_normals = read_vectors(bm.loops, "normal", num_loops)
+        if tangent_uv:
+            bm.calc_tangents(uvmap=tangent_uv)
+            basis_tangents = read_vectors(bm.loops, "tangent", num_loops)
+        for key in shape_keys.key_blocks[1:]:
+            if len(key.data) != num_verts:
+                print(f"*** WARNING *** Shape key {key.name} has {len(key.data)} verts, mesh has {num_verts}. Skipping!")
+                continue
+            key_co = read_vectors(key.data, "co", num_verts)
+            bm.vertices.foreach_set("co", key_co.reshape(-1))
+            bm.update()
+            bm.calc_normals_split()
+            blend = swg_types.SWGBLendShape()
+            blend.name = key.name
+            blend.position_indices, blend.position_deltas = moved_rows(key_co, basis_co, blend_epsilon)
+            blend.normal_indices, blend.normal_deltas = moved_rows(read_vectors(bm.loops, "normal", num_loops), basis_normals, blend_epsilon)
+            if tangent_uv:
+                bm.calc_tangents(uvmap=tangent_uv)
+                blend.dot3_indices, blend.dot3_deltas = moved_rows(read_vectors(bm.loops, "tangent", num_loops), basis_tangents, blend_epsilon)
+            print(f"Blend {key.name}: {len(blend.position_indices)} positions, {len(blend.normal_indices)} normals, {0 if blend.dot3_indices is None else len(blend.dot3_indices)} DOT3")
+            mgn.blends.append(blend)
+        bm.vertices.foreach_set("co", vertex_co.reshape(-1))
+        bm.update()
+        bm.calc_normals_split()
+
+    # triangles straight from the mesh's own triangulation: corner loops, corner vertices, materials
+    bm.calc_loop_triangles()
+    num_tris = len(bm.loop_triangles)
+    tri_loops = numpy.zeros(num_tris * 3, dtype=numpy.int32)
+    bm.loop_triangles.foreach_get("loops", tri_loops)
+    tri_verts = numpy.zeros(num_tris * 3, dtype=numpy.int32)
+    bm.loop_triangles.foreach_get("vertices", tri_verts)
+    tri_materials = numpy.zeros(num_tris, dtype=numpy.int32)
+    bm.loop_triangles.foreach_get("material_index", tri_materials)
+    materials, first_tri = numpy.unique(tri_materials, return_index=True)
+
+    for material_index in materials[numpy.argsort(first_tri)].tolist():
+        tris = numpy.flatnonzero(tri_materials == material_index)
+        corners = (tris[:, None] * 3 + numpy.arange(3)).reshape(-1)
         psdt = swg_types.SWGPerShaderData()
         psdt.name = current_obj.material_slots[material_index].material.name
         mgn.psdts.append(psdt)
 
-        reverse_position_lookup={}
-        pidx_id = 0
-        psdt.prims.append([])
-        psdt.uvs.append([])
-        psdt.dot3 = []
-        
-        for f in faces:
-            t1=None
-            t2=None
-            t3=None
-            for uv_index, l_index in enumerate(f.loop_indices):
-                master_vert_id = f.vertices[uv_index]
-
-                if not master_vert_id in reverse_position_lookup:
-                    reverse_position_lookup[master_vert_id] =  pidx_id                    
-                    pidx_id += 1
-
-                psdt.pidx.append(master_vert_id)
-                psdt.nidx.append(l_index)
-                psdt.uvs[0].append(uv_layer[l_index].uv)
-
-                if do_tangents:
-                    psdt.dot3.append(l_index)
-                
-                if last_tri_index == None:
-                    last_tri_index = l_index
-                    print(f"Starting last_tri_index at {last_tri_index}")
-                    
-                if t1 == None:
-                    t1 = running_tri_index
-                elif t2 == None:
-                    t2 = running_tri_index
-                else:
-                    t3 = running_tri_index
-                    psdt.prims[0].append(t3)
-                    psdt.prims[0].append(t2)
-                    psdt.prims[0].append(t1)
-
-                running_tri_index += 1
-
-    vertex_groups = current_obj.vertex_groups
-    bone_names = vertex_groups.keys()
-    twdtdata = {}
-    for name in bone_names:
-        mgn.bone_names.append(name)
-        selverts = [v for v in bm.vertices]
-        indexval = current_obj.vertex_groups[name].index
-        for v in selverts:
-            for n in v.groups:
-                if n.group == indexval:
-                    if not v.index in twdtdata:
-                        twdtdata[v.index] = []
-                    twdtdata[v.index].append([indexval, n.weight])
-    od = collections.OrderedDict(sorted(twdtdata.items()))
-    mgn.twdt = list(od.values())
+        # one PSDT vertex per corner (weld merges them), triangles wound the other way round
+        psdt.pidx = tri_verts[corners].tolist()
+        psdt.nidx = tri_loops[corners].tolist()
+        psdt.uvs.append(loop_uvs[tri_loops[corners]])
+        psdt.dot3 = list(psdt.nidx) if tangent_uv else []
+        psdt.prims.append(numpy.arange(len(corners)).reshape(-1, 3)[:, ::-1].reshape(-1).tolist())
+
+        if do_weld:
+            before, after = psdt.weld(mgn.normals, mgn.dot3, weld_epsilon, mgn.blends)
+            print(f"Welded {psdt.name}: {before} -> {after} verts ({100 * (before - after) / max(before, 1):.1f}% fewer)")
+
+    # vertex group indices are the TWDT bone indices; every vertex gets a TWHD entry, even unweighted
+    mgn.bone_names = current_obj.vertex_groups.keys()
+    mgn.weights = swg_types.SWGSkinWeights.from_vertex_lists([[[g.group, g.weight] for g in v.groups] for v in bm.vertices])
+    dropped = mgn.weights.limit(max_influences, weight_threshold)
+    renormalized = mgn.weights.normalize()
+    print(f"Dropped {dropped} bone influences, renormalized {renormalized} vertices")
+    if palette_limit > 0:
+        mgn.split_palettes(palette_limit)
+    max_vertex, max_shader = mgn.update_transform_counts()
+    print(f"Weights: {mgn.weights} Max transforms per vertex: {max_vertex} per shader: {max_shader}")
+
+    (norm_before, norm_after), (dot3_before, dot3_after) = mgn.pool_vectors(pool_tolerance)
+    print(f"Pooled NORM {norm_before} -> {norm_after}, DOT3 {dot3_before} -> {dot3_after}")
+
+    if do_vertex_cache:
+        mgn.optimize_vertex_cache()
+
+    current_obj.to_mesh_clear()
 
     print(f"Assembling final IFF ... ")
     mgn.write()
@@ -21,6 +21,7 @@
 # allow you to load the textures properly in Blender. (MGN UV's are upside down)
 # ##############################################################################
 import bpy, struct, array
+import numpy
 from . import swg_types
 
 from bpy.props import *
@@ -33,104 +34,96 @@ def import_mgn( context,
                 global_matrix=None):
 
     mgn = swg_types.SWGMgn(filepath)
-    mgn.load()
+    mgn.load(as_arrays=True)
+    print(mgn)
 
     mesh_name = filepath.split('\\')[-1].split('.')[0]
     mesh = bpy.data.meshes.new(mesh_name)
-        
-    edges=[]
-    blender_verts = []
-    blender_norms = []
-    for v in mgn.positions:
-        blender_verts.append([v[0],v[1],v[2]])
-
-    for n in mgn.normals:
-        blender_norms.append([n[0],n[1],-n[2]])
-
-    faces_by_material=[]
-    normals=[]
-    tris = []
-    tris_flat = []
-    uvs_flat = []
+
+    # MGN z is mirrored relative to Blender, so normals flip z (positions already are by load)
+    blender_norms = mgn.normals * numpy.array([1, 1, -1], dtype=numpy.float32)
+
+    # every PSDT triangle as three loops, wound the other way round for Blender
+    tri_material = []
+    loop_pidx = []
+    loop_nidx = []
+    uvs_flat = {}
     for pid, psdt in enumerate(mgn.psdts):
         mat = bpy.data.materials.new(psdt.stripped_shader_name())
-        mesh.materials.append(mat)        
-        faces_by_material.append([])
-
-        for prim in psdt.prims:
-            for tri in prim:
-                p1 = psdt.pidx[tri.p3]
-                p2 = psdt.pidx[tri.p2]
-                p3 = psdt.pidx[tri.p1]
-                
-                normals.append(blender_norms[psdt.nidx[tri.p3]])
-                normals.append(blender_norms[psdt.nidx[tri.p2]])
-                normals.append(blender_norms[psdt.nidx[tri.p1]])
-
-                tris_flat.append(p1)
-                tris_flat.append(p2)
-                tris_flat.append(p3)
-                tris.append([p1, p2, p3])
-                faces_by_material[pid].append((p1, p2, p3))
-
-
-                for uv_layer_num in range(0, psdt.num_uvs):                    
-                    if psdt.uv_dimensions[uv_layer_num] != 2:
-                        print(f"*** Warning *** Not handling UV layer {uv_layer_num} with dimension: {psdt.uv_dimensions[uv_layer_num]}")
-                        continue 
-                    if len(uvs_flat) <= uv_layer_num:
-                        uvs_flat.append([])
-                    
-                    uvs_flat[uv_layer_num].append(psdt.uvs[uv_layer_num][tri.p3])
-                    uvs_flat[uv_layer_num].append(psdt.uvs[uv_layer_num][tri.p2])
-                    uvs_flat[uv_layer_num].append(psdt.uvs[uv_layer_num][tri.p1])
-
-    mesh.from_pydata(blender_verts, edges, tris)
+        mesh.materials.append(mat)
+
+        tris = numpy.concatenate(psdt.prims) if len(psdt.prims) > 0 else numpy.zeros((0, 3), dtype=numpy.int32)
+        corners = tris[:, ::-1].reshape(-1)
+        loop_pidx.append(psdt.pidx[corners])
+        loop_nidx.append(psdt.nidx[corners])
+        tri_material.append(numpy.full(len(tris), pid, dtype=numpy.int32))
+
+        for uv_layer_num in range(0, psdt.num_uvs):
+            if psdt.uv_dimensions[uv_layer_num] != 2:
+                print(f"*** Warning *** Not handling UV layer {uv_layer_num} with dimension: {psdt.uv_dimensions[uv_layer_num]}")
+                continue
+            uvs_flat.setdefault(uv_layer_num, []).append(psdt.uvs[uv_layer_num][corners])
+
+    loop_pidx = numpy.concatenate(loop_pidx).astype(numpy.int32) if loop_pidx else numpy.zeros(0, dtype=numpy.int32)
+    loop_normals = blender_norms[numpy.concatenate(loop_nidx)] if loop_nidx else numpy.zeros((0, 3), dtype=numpy.float32)
+    num_loops = len(loop_pidx)
+    num_tris = num_loops // 3
+    tri_material = numpy.concatenate(tri_material) if tri_material else numpy.zeros(0, dtype=numpy.int32)
+
+    mesh.vertices.add(len(mgn.positions))
+    mesh.vertices.foreach_set("co", numpy.ascontiguousarray(mgn.positions, dtype=numpy.float32).reshape(-1))
+    mesh.loops.add(num_loops)
+    mesh.loops.foreach_set("vertex_index", loop_pidx)
+    mesh.polygons.add(num_tris)
+    mesh.polygons.foreach_set("loop_start", numpy.arange(0, num_loops, 3, dtype=numpy.int32))
+    if bpy.app.version < (3, 6, 0):
+        # polygon sizes come from the loop_start offsets from 3.6 on, where loop_total is read only
+        mesh.polygons.foreach_set("loop_total", numpy.full(num_tris, 3, dtype=numpy.int32))
+    mesh.polygons.foreach_set("material_index", tri_material)
+    mesh.update(calc_edges=True)
+
+    for i in sorted(uvs_flat):
+        uvs = numpy.concatenate(uvs_flat[i]).astype(numpy.float32)
+        print(f'UV Layer: {i} -- lengths of UVs ({len(uvs)}) and Tri indecies ({num_loops})')
+        if len(uvs) != num_loops:
+            print(f'*** WARNING *** UV Layer: {i} -- Unmatched lengths of UVs ({len(uvs)}) and Tri indecies ({num_loops}). Skipping!')
+            continue
+        uvs[:, 1] = 1 - uvs[:, 1]
+        uvlayer = mesh.uv_layers.new(name=f'UVMap-{str(i)}')
+        mesh.uv_layers.active = uvlayer
+        uvlayer.data.foreach_set("uv", uvs.reshape(-1))
+
     mesh.use_auto_smooth = True
-    mesh.normals_split_custom_set(normals)
+    mesh.normals_split_custom_set(loop_normals.tolist())
     mesh.transform(global_matrix)
     scene_object = bpy.data.objects.new(mesh_name, mesh)
     context.collection.objects.link(scene_object)
-    mesh.validate()
+    mesh.validate(clean_customdata=False)
     mesh.update()        
 
-    for flist in mesh.polygons: 
-        for id, face_list in enumerate(faces_by_material):
-            if flist.vertices[:] in face_list:
-                flist.material_index = id
-
-    for i, uvs in enumerate(uvs_flat):
-        print(f'UV Layer: {i} -- lengths of UVs ({len(uvs)}) and Tri indecies ({len(tris_flat)})')
-        if len(uvs) != len(tris_flat):
-            print(f'*** WARNING *** UV Layer: {i} -- Unmatched lengths of UVs ({len(uvs)}) and Tri indecies ({len(tris_flat)}). Skipping!')
-            continue
-        uvlayer = mesh.uv_layers.new(name=f'UVMap-{str(i)}')
-        mesh.uv_layers.active = uvlayer
-        for ind, vert in enumerate(tris_flat):
-            uv = [uvs[ind][0], 1 - uvs[ind][1]]
-            uvlayer.data[ind].uv = uv
-
     vgs = {}
     for i, bone in enumerate(mgn.bone_names):
         vg = scene_object.vertex_groups.new(name=bone)
         vgs[i] = vg
 
-    for i, vertex_weights in enumerate(mgn.vertex_weights):
-        sum=0
-        for weight in vertex_weights:
-            if sum + weight[1] > 1.0:
-                weight[1] = (1.0 - sum)
-                print(f"Capped bone weight contribution of: {i} {weight[0]} to {weight[1]}!")
-            vgs[weight[0]].add([i], weight[1], 'ADD')
+    if mgn.weights is not None:
+        capped = mgn.weights.cap_sums()
+        if capped > 0:
+            print(f"Capped {capped} bone weight contributions so no vertex totals more than 1!")
+        for bone, weight, vertices in mgn.weights.weight_groups():
+            vgs[bone].add(vertices, weight, 'ADD')
     
     scene_object.shape_key_add(name='Basis')
+    basis = numpy.zeros(len(mesh.vertices) * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("co", basis)
+    basis = basis.reshape(-1, 3)
+    # deltas are directions, so they get the rotation part of global_matrix only
+    delta_matrix = numpy.array(global_matrix.to_3x3(), dtype=numpy.float32).T * numpy.array([[1], [1], [-1]], dtype=numpy.float32)
     for i, blend in enumerate(mgn.blends):
         sk = scene_object.shape_key_add(name=blend.name)
-        for vert in blend.positions:
-            id = vert[0]
-            delta = [vert[1][0], vert[1][1], -vert[1][2]]
-            delta_v = Vector(delta)
-            sk.data[id].co = scene_object.data.vertices[id].co + (global_matrix @ delta_v)
+        co = basis.copy()
+        numpy.add.at(co, blend.position_indices, blend.position_deltas @ delta_matrix)
+        sk.data.foreach_set("co", co.reshape(-1))
     
     for i, skel in enumerate(mgn.skeletons):
         scene_object[f'SKTM_{i}'] = skel
@@ -1,8 +1,18 @@
-import struct, io, builtins, os
+import struct, io, builtins, os, mmap, sys, array, itertools
 import time
 import datetime
 
 timesExpanded = 0
+
+# struct format char -> little endian numpy dtype, for the bulk readers
+BULK_DTYPES = {
+    'f': '<f4',
+    'i': '<i4',
+    'I': '<u4',
+    'h': '<i2',
+    'H': '<u2',
+}
+
 class StackFrame():
     def __init__(self, start, length, used):
         self.start = start
@@ -16,19 +26,104 @@ class StackFrame():
         return self.__str__()
 
 
-class IFF():
+class ChunkDataWriter():
+    # typed helpers shared by IFF and IFFWriter. Everything funnels into insertChunkData
+
+    def insert_byte(self, b):
+        self.insertChunkData(int.to_bytes(b, 1, byteorder="little", signed=False))
+
+    def insert_bool(self, b):
+        self.insert_byte(1 if b else 0)
+
+    def insertChunkString(self, s, nullTerminate = True):
+        self.insertChunkData(s.encode('ASCII'))
+        if nullTerminate:
+            self.insert_byte(0)
+
+    def insertFloat(self, f):
+        self.insertChunkData(struct.pack('f', f))
 
-    def __init__(self, *, initial_size = 0, filename = ""):
+    def insertFloatVector4(self, vec):
+        self.insertFloat(vec[0])
+        self.insertFloat(vec[1])
+        self.insertFloat(vec[2])
+        self.insertFloat(vec[3])
+
+    def insertFloatVector3(self, vec):
+        self.insertFloat(vec[0])
+        self.insertFloat(vec[1])
+        self.insertFloat(vec[2])
+
+    def insertFloatVector2(self, vec):
+        self.insertFloat(vec[0])
+        self.insertFloat(vec[1])
+
+    def insert_int16(self, i):
+        self.insertChunkData(int.to_bytes(i, 2, byteorder="little", signed=True))
+
+    def insert_uint16(self, i):
+        self.insertChunkData(int.to_bytes(i, 2, byteorder="little", signed=False))
+
+    def insert_int32(self, i):
+        self.insertChunkData(int.to_bytes(i, 4, byteorder="little", signed=True))
+
+    def insert_uint32(self, i):
+        self.insertChunkData(int.to_bytes(i, 4, byteorder="little", signed=False))
+
+    def insertArray(self, fmt, values):
+        # values can be any sequence, an array.array or a numpy array; written with a single copy
+        if hasattr(values, 'dtype'):
+            self.insertChunkData(values.astype(BULK_DTYPES[fmt], copy=False).tobytes())
+        elif isinstance(values, array.array) and values.typecode == fmt and values.itemsize == struct.calcsize(fmt) and sys.byteorder == 'little':
+            self.insertChunkData(values.tobytes())
+        else:
+            if not isinstance(values, (list, tuple)):
+                values = list(values)
+            self.insertChunkData(struct.pack(f'<{len(values)}{fmt}', *values))
+
+    def insertFloatArray(self, values):
+        self.insertArray('f', values)
+
+    def insertInt32Array(self, values):
+        self.insertArray('i', values)
+
+    def insertUint32Array(self, values):
+        self.insertArray('I', values)
+
+    def insertInt16Array(self, values):
+        self.insertArray('h', values)
+
+    def insertUint16Array(self, values):
+        self.insertArray('H', values)
+
+    def insertVec3Array(self, values):
+        if hasattr(values, 'dtype'):
+            self.insertArray('f', values.reshape(-1))
+        else:
+            self.insertArray('f', list(itertools.chain.from_iterable(v[0:3] for v in values)))
+
+    def insertVec4Array(self, values):
+        if hasattr(values, 'dtype'):
+            self.insertArray('f', values.reshape(-1))
+        else:
+            self.insertArray('f', list(itertools.chain.from_iterable(v[0:4] for v in values)))
+
+
+class IFF(ChunkDataWriter):
+
+    def __init__(self, *, initial_size = 0, filename = "", use_mmap = False):
         self.inChunk = False
         self.stack = []
         self.length = 0
         self.data = None
+        self.view = None
+        self.mmap = None
         self.stack_depth = 0
         self.in_chunk = False
         self.timesExpanded = 0
 
         if filename != "":
-            self.open_file(filename)
+            self.open_file(filename, use_mmap=use_mmap)
         else:
             self.length = initial_size
             self.data = bytearray(initial_size)
@@ -37,9 +132,15 @@ class IFF():
             self.stack.append(s)
 
 
-    def open_file(self, file_path, mode = 'rb'):
+    def open_file(self, file_path, mode = 'rb', use_mmap = False):
         source_stream = builtins.open(file_path, mode)
-        self.data = source_stream.read()
+        # mmap mode: reads hand out memoryview windows into the mapping instead of copying
+        if use_mmap and os.fstat(source_stream.fileno()).st_size > 0:
+            self.mmap = mmap.mmap(source_stream.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = self.mmap
+            self.view = memoryview(self.mmap)
+        else:
+            self.data = source_stream.read()
         source_stream.close()
 
         self.length = len(self.data)
@@ -48,6 +149,27 @@ class IFF():
 
         #print(self.data)
 
+    def close(self):
+        # sub-readers share the parent's mapping, so only the owner releases it
+        if self.mmap is not None:
+            self.view.release()
+            self.mmap.close()
+        self.view = None
+        self.mmap = None
+        self.data = None
+
+    def buildIndex(self):
+        return IFFIndex(self)
+
+    def openNode(self, node):
+        # reader over a single indexed FORM or chunk, positioned on its header
+        sub = IFF()
+        sub.data = self.data
+        sub.view = self.view
+        sub.length = self.length
+        sub.stack = [StackFrame(node.offset, node.size + 8, 0)]
+        return sub
+
     def getCurrentName(self):
         return self.getBlockName(self.stack_depth)
 
@@ -147,11 +269,69 @@ class IFF():
 
     def read_misc(self, readLength):
         s = self.stack[self.stack_depth]
-        readData = self.data[s.start + s.used:s.start + s.used + readLength]
+        if self.view is not None:
+            readData = self.view[s.start + s.used:s.start + s.used + readLength]
+        else:
+            readData = self.data[s.start + s.used:s.start + s.used + readLength]
         s.used += readLength
         self.stack[self.stack_depth] = s
         return readData
 
+    def read_view(self, readLength):
+        s = self.stack[self.stack_depth]
+        view = self.view if self.view is not None else memoryview(self.data)
+        readData = view[s.start + s.used:s.start + s.used + readLength]
+        s.used += readLength
+        return readData
+
+    def read_chunk_view(self):
+        # memoryview over the unread remainder of the current chunk; consumes it
+        s = self.stack[self.stack_depth]
+        return self.read_view(s.length - s.used)
+
+    def read_values(self, fmt, count = None, as_numpy = False):
+        # decode count values of a single struct format char in one call.
+        # count = None reads whole values up to the end of the current chunk
+        size = struct.calcsize(fmt)
+        if count is None:
+            s = self.stack[self.stack_depth]
+            count = (s.length - s.used) // size
+        if as_numpy:
+            return self.read_array(BULK_DTYPES[fmt], count)
+        return list(struct.unpack_from(f'<{count}{fmt}', self.read_view(count * size)))
+
+    def read_array(self, dtype, count = None):
+        # numpy array of any dtype (including record dtypes) with a single copy out of the file
+        # data, so nothing keeps a reference into a mapped file.
+        # count = None reads whole items up to the end of the current chunk
+        import numpy
+        dtype = numpy.dtype(dtype)
+        if count is None:
+            s = self.stack[self.stack_depth]
+            count = (s.length - s.used) // dtype.itemsize
+        return numpy.frombuffer(self.read_view(count * dtype.itemsize), dtype=dtype, count=count).copy()
+
+    def read_floats(self, count = None, as_numpy = False):
+        return self.read_values('f', count, as_numpy)
+
+    def read_int32s(self, count = None, as_numpy = False):
+        return self.read_values('i', count, as_numpy)
+
+    def read_uint32s(self, count = None, as_numpy = False):
+        return self.read_values('I', count, as_numpy)
+
+    def read_int16s(self, count = None, as_numpy = False):
+        return self.read_values('h', count, as_numpy)
+
+    def read_uint16s(self, count = None, as_numpy = False):
+        return self.read_values('H', count, as_numpy)
+
+    def read_vec3s(self, count = None, as_numpy = False):
+        floats = self.read_floats(None if count is None else count * 3, as_numpy)
+        if as_numpy:
+            return floats.reshape(-1, 3)
+        return list(zip(floats[0::3], floats[1::3], floats[2::3]))
+
     def read_bool8(self):
         return self.read_misc(1) != 0
 
@@ -168,7 +348,7 @@ class IFF():
         return int.from_bytes(self.read_misc(2), byteorder='little', signed=False)
 
     def read_byte(self):
-        return self.read_misc(1)
+        return bytes(self.read_misc(1))
 
     def read_string(self):
         s = self.stack[self.stack_depth]
@@ -329,47 +509,6 @@ class IFF():
 
         self.stack[self.stack_depth].used += len(newData)
 
-    def insert_byte(self, b):
-        self.insertChunkData(int.to_bytes(b, 1, byteorder="little", signed=False))
-
-    def insert_bool(self, b):
-        self.insert_byte(1 if b else 0)
-
-    def insertChunkString(self, s, nullTerminate = True):
-        self.insertChunkData(s.encode('ASCII'))
-        if nullTerminate:
-            self.insert_byte(0)
-
-    def insertFloat(self, f):
-        self.insertChunkData(struct.pack('f', f))
-
-    def insertFloatVector4(self, vec):
-        self.insertFloat(vec[0])
-        self.insertFloat(vec[1])
-        self.insertFloat(vec[2])
-        self.insertFloat(vec[3])
-
-    def insertFloatVector3(self, vec):
-        self.insertFloat(vec[0])
-        self.insertFloat(vec[1])
-        self.insertFloat(vec[2])
-
-    def insertFloatVector2(self, vec):
-        self.insertFloat(vec[0])
-        self.insertFloat(vec[1])
-
-    def insert_int16(self, i):
-        self.insertChunkData(int.to_bytes(i, 2, byteorder="little", signed=True))
-
-    def insert_uint16(self, i):
-        self.insertChunkData(int.to_bytes(i, 2, byteorder="little", signed=False))
-
-    def insert_int32(self, i):
-        self.insertChunkData(int.to_bytes(i, 4, byteorder="little", signed=True))
-
-    def insert_uint32(self, i):
-        self.insertChunkData(int.to_bytes(i, 4, byteorder="little", signed=False))
-
     def insertIff(self, iff):
         #make sure the data array can handle this addition
         newLength=iff.stack[0].length
@@ -407,4 +546,166 @@ class IFF():
         f.write(self.data[0:self.stack[0].length])
         f.close()
         now = time.time() 
-        #print("Writing data took: " + str(datetime.timedelta(seconds=(now - t))))
\ No newline at end of file
+        #print("Writing data took: " + str(datetime.timedelta(seconds=(now - t))))
+
+
+class IFFNode():
+    __slots__ = ('tag', 'name', 'offset', 'size', 'depth', 'parent', 'children')
+    def __init__(self, tag, name, offset, size, depth, parent):
+        self.tag = tag          # "FORM" or the chunk tag
+        self.name = name        # form name for forms, the tag for chunks
+        self.offset = offset    # offset of the block header
+        self.size = size        # size field from the header
+        self.depth = depth
+        self.parent = parent
+        self.children = []
+
+    def isForm(self):
+        return self.tag == "FORM"
+
+    def dataOffset(self):
+        return self.offset + (12 if self.isForm() else 8)
+
+    def dataLength(self):
+        return self.size - 4 if self.isForm() else self.size
+
+    def __str__(self):
+        return f'{self.tag} {self.name} Offset: {self.offset} Size: {self.size} Depth: {self.depth}'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class IFFIndex():
+    # One pass table of contents of every FORM and chunk, for random access by path,
+    # e.g. index.find("SKMG/0004/PSDT[6]/NAME"). Segments match form names or chunk tags
+    # (trailing spaces optional) and [n] picks the nth match among siblings.
+
+    def __init__(self, iff):
+        self.iff = iff
+        self.nodes = []
+        self.root = IFFNode("", "", 0, iff.stack[0].length, -1, None)
+
+        data = iff.data
+        pending = [(self.root, 0, iff.stack[0].length)]
+        while pending:
+            parent, offset, end = pending.pop()
+            children = []
+            while offset + 8 <= end:
+                tag, size = struct.unpack_from('>4sI', data, offset)
+                tag = tag.decode('ASCII')
+                if offset + 8 + size > end:
+                    print(f"[IFFIndex] {tag} at {offset} overruns its parent ({offset + 8 + size} > {end})")
+                    break
+                if tag == "FORM":
+                    name = bytes(data[offset+8:offset+12]).decode('ASCII')
+                    node = IFFNode(tag, name, offset, size, parent.depth + 1, parent)
+                    pending.append((node, offset + 12, offset + 8 + size))
+                else:
+                    node = IFFNode(tag, tag, offset, size, parent.depth + 1, parent)
+                children.append(node)
+                offset += 8 + size
+            parent.children = children
+            self.nodes += children
+        self.nodes.sort(key=lambda n: n.offset)
+
+    def findAll(self, path):
+        matches = [self.root]
+        for segment in path.strip('/').split('/'):
+            which = None
+            if segment.endswith(']'):
+                segment, which = segment[:-1].split('[')
+                which = int(which)
+            segment = segment.rstrip()
+            next_matches = []
+            for node in matches:
+                named = [c for c in node.children if c.name.rstrip() == segment]
+                if which is None:
+                    next_matches += named
+                elif which < len(named):
+                    next_matches.append(named[which])
+            matches = next_matches
+        return matches
+
+    def find(self, path):
+        matches = self.findAll(path)
+        return matches[0] if matches else None
+
+    def open(self, node):
+        if isinstance(node, str):
+            path = node
+            node = self.find(path)
+            if node is None:
+                print(f"[IFFIndex] Nothing found at: {path}")
+                return None
+        return self.iff.openNode(node)
+
+
+class IFFWriter(ChunkDataWriter):
+    # Append-only IFF builder with the same insert/exit API as IFF. Writers only ever
+    # add data at the end, so blocks are written with a placeholder size that gets
+    # patched once when the block is exited instead of on every insert.
+
+    def __init__(self):
+        self.data = bytearray()
+        self.stack = []
+        self.inChunk = False
+
+    def insertForm(self, name, shouldEnterForm = True):
+        start = len(self.data)
+        self.data += b'FORM'
+        self.data += int.to_bytes(4, 4, byteorder='big', signed=False)
+        self.data += name.encode('ASCII')
+        if shouldEnterForm:
+            self.stack.append(start)
+
+    def insertNumberedForm(self, n, shouldEnterForm = True):
+        s=str(n).zfill(4)
+        self.insertForm(s, shouldEnterForm)
+
+    def insertChunk(self, name, shouldEnterChunk = True):
+        start = len(self.data)
+        self.data += name.encode('ASCII')
+        self.data += int.to_bytes(0, 4, byteorder='big', signed=False)
+        if shouldEnterChunk:
+            self.stack.append(start)
+            self.inChunk = True
+
+    def exitForm(self, name = ""):
+        start = self.stack[-1]
+        if name != "" and self.data[start+8:start+12].decode('ASCII') != name:
+            print(f"[ExitForm] Requested: {name} but found {self.data[start+8:start+12].decode('ASCII')}")
+            return
+        self.patchLength(self.stack.pop())
+
+    def exitChunk(self, name):
+        start = self.stack[-1]
+        if self.data[start:start+4].decode('ASCII') != name:
+            print(f"[ExitChunk] Requested: {name} but found {self.data[start:start+4].decode('ASCII')}")
+            return
+        self.patchLength(self.stack.pop())
+        self.inChunk = False
+
+    def patchLength(self, start):
+        length = len(self.data) - start - 8
+        self.data[start+4:start+8] = int.to_bytes(length, 4, byteorder='big', signed=False)
+
+    def insertChunkData(self, newData):
+        self.data += newData
+
+    def insertIff(self, iff):
+        if isinstance(iff, IFFWriter):
+            self.data += iff.data
+        else:
+            self.data += iff.data[0:iff.stack[0].length]
+
+    def insertIffData(self, data):
+        self.data += data
+
+    def write(self, file_path):
+        # blocks that are still open (usually the root forms) run to the end of the data
+        for start in self.stack:
+            self.patchLength(start)
+        f = builtins.open(file_path, 'wb')
+        f.write(self.data)
+        f.close()
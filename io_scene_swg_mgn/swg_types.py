@@ -20,10 +20,151 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
 import math
+import struct
+import numpy
 from . import nsg_iff
 from . import vector3D
 from . import vertex_buffer_format
+from . import vertex_cache
+
+# OITL record: occlusion zone + triangle
+OITL_DTYPE = numpy.dtype([('occ', '<i2'), ('tri', '<i4', (3,))])
+# TWDT record: transform (bone) index + weight
+TWDT_DTYPE = numpy.dtype([('bone', '<u4'), ('weight', '<f4')])
+# BLT POSN/NORM/DOT3 record: pool index + delta
+BLT_DTYPE = numpy.dtype([('index', '<u4'), ('delta', '<f4', (3,))])
+
+def blend_arrays(pairs):
+    # (index, (x, y, z)) pairs -> int32 indices, float32 (K,3) deltas
+    indices = numpy.array([p[0] for p in pairs], dtype=numpy.int32)
+    deltas = numpy.array([p[1][0:3] for p in pairs], dtype=numpy.float32).reshape(-1, 3)
+    return indices, deltas
+
+def blend_records(indices, deltas):
+    records = numpy.empty(len(indices), dtype=BLT_DTYPE)
+    records['index'] = indices
+    records['delta'] = deltas
+    return records
+
+# position, normal, one 2D uv set: what SWGMesh.write used for every SPS before flags were honoured
+DEFAULT_SPS_FLAGS = 4357
+
+def vertex_fields(verts, layout):
+    # SWGVertex list -> {field name: array} for VertexLayout.records
+    fields = {}
+    if vertex_buffer_format.hasPosition(layout.flags):
+        fields['position'] = [(v.pos.x, v.pos.y, v.pos.z) for v in verts]
+    if vertex_buffer_format.hasNormal(layout.flags):
+        fields['normal'] = [(v.normal.x, v.normal.y, v.normal.z) for v in verts]
+    if vertex_buffer_format.hasColor0(layout.flags):
+        fields['color0'] = [v.color or 0 for v in verts]
+    for i, dim in enumerate(layout.uv_dimensions):
+        zero = [0.0] * dim
+        fields[f'uv{i}'] = [(v.texs[i][0:dim] if len(v.texs) > i and len(v.texs[i]) >= dim else zero) for v in verts]
+    return fields
+
+# INDX entries are 16 bit unless an index is too big for them
+MAX_VERTS_16 = 0x10000
+
+def split_indices(tris, max_verts = MAX_VERTS_16):
+    # split a (T,3) index array into runs of whole triangles that each reference at most max_verts
+    # distinct vertices. Returns [(vertex ids or None if unchanged, local (T,3) indices), ...]
+    tris = numpy.asarray(tris, dtype=numpy.int64).reshape(-1, 3)
+    if len(tris) == 0 or tris.max() < max_verts:
+        return [(None, tris)]
+    runs = []
+    start = 0
+    while start < len(tris):
+        flat = tris[start:].reshape(-1)
+        # distinct vertex count after each index = running count of first occurrences
+        _, first = numpy.unique(flat, return_index=True)
+        seen = numpy.zeros(len(flat), dtype=numpy.int64)
+        seen[first] = 1
+        seen = numpy.cumsum(seen)[2::3]
+        end = start + max(1, int(numpy.searchsorted(seen, max_verts, side='right')))
+        ids, local = numpy.unique(tris[start:end], return_inverse=True)
+        runs.append((ids, local.reshape(-1, 3)))
+        start = end
+    return runs
+
+def reorder(values, ids):
+    # values[ids] for an ndarray, a list otherwise
+    if hasattr(values, 'dtype'):
+        return values[ids]
+    return [values[i] for i in ids.tolist()]
+
+def as_rows(rows):
+    # float64 (N,K) array of rows; reshape can't infer K for an empty input, so that is (0,0)
+    rows = numpy.asarray(rows, dtype=numpy.float64)
+    return rows.reshape(len(rows), -1) if len(rows) > 0 else rows.reshape(0, 0)
+
+def pool_rows(rows, tolerance = 0.0):
+    # rows equal after quantising to tolerance (exactly equal if 0) share one pool entry.
+    # Returns (row kept for each pool entry in first use order, pool entry of every row)
+    rows = as_rows(rows)
+    if len(rows) == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    keys = numpy.round(rows / tolerance) if tolerance > 0 else rows
+    _, first, inverse = numpy.unique(keys, axis=0, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    remap = numpy.empty(len(first), dtype=numpy.int64)
+    remap[order] = numpy.arange(len(first))
+    return first[order], remap[inverse.reshape(-1)]
+
+def blend_columns(rows, blends):
+    # rows with every blend's delta for each row appended (0 where a blend doesn't touch it),
+    # so rows only pool together when they also move the same way in every blend
+    rows = as_rows(rows)
+    columns = numpy.zeros((len(rows), 3 * len(blends)), dtype=numpy.float64)
+    for i, (indices, deltas) in enumerate(blends):
+        columns[numpy.asarray(indices, dtype=numpy.int64), 3*i:3*i+3] = numpy.asarray(deltas).reshape(-1, 3)
+    return numpy.hstack((rows, columns))
+
+def remap_indices(indices, remap):
+    # remap[indices], as the same kind of container indices came in
+    new_indices = remap[numpy.asarray(indices, dtype=numpy.int64)]
+    return new_indices if hasattr(indices, 'dtype') else new_indices.tolist()
+
+def remap_blend(indices, deltas, remap, tolerance = 0.0):
+    # blend entries moved onto pooled indices. Every row merged into one entry has to carry the
+    # same delta (within tolerance, 0 for rows the blend doesn't touch), anything else is an error
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    deltas = numpy.asarray(deltas, dtype=numpy.float32).reshape(-1, 3)
+    if len(indices) > 0 and (indices.min() < 0 or indices.max() >= len(remap)):
+        raise ValueError(f"Blend index out of range: {int(indices.min())}..{int(indices.max())} for a pool of {len(remap)}")
+    row_deltas = numpy.zeros((len(remap), 3), dtype=numpy.float32)
+    row_deltas[indices] = deltas
+    pooled = numpy.zeros((int(remap.max()) + 1 if len(remap) > 0 else 0, 3), dtype=numpy.float32)
+    pooled[remap[indices]] = deltas
+    if len(remap) > 0 and numpy.abs(row_deltas - pooled[remap]).max() > tolerance:
+        raise ValueError("Pooled blend rows carry different deltas")
+    new_indices = numpy.unique(remap[indices])
+    return new_indices.astype(numpy.int32), pooled[new_indices]
+
+def optimize_triangle_lists(prims, num_verts, cache_size = vertex_cache.CACHE_SIZE):
+    # vertex cache order for a set of triangle lists sharing one vertex buffer: each list's
+    # triangles are reordered, then the vertices renumbered in first use order.
+    # Returns (new (T,3) lists, old vertex id of each new vertex, ACMR before, ACMR after)
+    prims = [numpy.array(flat_indices(prim), dtype=numpy.int64).reshape(-1, 3) for prim in prims]
+    num_tris = sum(len(prim) for prim in prims)
+    if num_tris == 0:
+        return prims, numpy.arange(num_verts), 0.0, 0.0
+    before = sum(vertex_cache.acmr(prim, cache_size) * len(prim) for prim in prims) / num_tris
+    prims = [prim[vertex_cache.optimize(prim, cache_size)] for prim in prims]
+    old_ids, tris = vertex_cache.fetch_order(numpy.concatenate(prims), num_verts)
+    prims = numpy.split(tris, numpy.cumsum([len(prim) for prim in prims])[:-1])
+    after = sum(vertex_cache.acmr(prim, cache_size) * len(prim) for prim in prims) / num_tris
+    return prims, old_ids, before, after
+
+def flat_indices(tris):
+    # flat index list from a (T,3) array, a list of Triangles or an already flat list
+    if hasattr(tris, 'dtype'):
+        return tris.reshape(-1)
+    if len(tris) > 0 and isinstance(tris[0], Triangle):
+        return [p for t in tris for p in (t.p1, t.p2, t.p3)]
+    return tris
 
 class SWGVertex(object):
     __slots = ('pos', 'normal', 'color', 'texs')
@@ -69,6 +210,20 @@ class SPS(object):
     def __str__(self):
         return f"SPS_No: {self.no} Shader: {self.shader} Flags: {self.flags} Verts: {len(self.verts)} Tris: {len(self.tris)}"
 
+    def optimize_vertex_cache(self, cache_size = vertex_cache.CACHE_SIZE):
+        # reorder tris for the post-transform cache and verts to match. Returns ACMR before and after
+        if isinstance(self.verts, dict):
+            num_verts = len(next(iter(self.verts.values()), []))
+        else:
+            num_verts = len(self.verts)
+        (tris,), old_ids, before, after = optimize_triangle_lists([self.tris], num_verts, cache_size)
+        if isinstance(self.verts, dict):
+            self.verts = {name: reorder(numpy.asarray(values), old_ids) for name, values in self.verts.items()}
+        else:
+            self.verts = reorder(self.verts, old_ids)
+        self.tris = tris
+        return before, after
+
     def __repr__(self):
         return self.__str__()
 
@@ -111,54 +266,15 @@ class SWGMesh(object):
             print(f'Mesh: {self.filename} SPS: {sps_no} Flags: {flags}: Has Color1. Never seen that before! Not doing anything with it FYI')
 
 
-    def read_vertex(self, flags, iff):
-        v = SWGVertex()
-
-        num_uv_sets = vertex_buffer_format.getNumberOfTextureCoordinateSets(flags)
-        skip_dot3 = False
-        if(num_uv_sets > 0) and (vertex_buffer_format.getTextureCoordinateSetDimension(flags, num_uv_sets - 1) == 4):
-            skip_dot3 = True
-            num_uv_sets -= 1
-
-        v.texs = []
-
-        if vertex_buffer_format.hasPosition(flags):
-            v.pos =  vector3D.Vector3D(iff.read_float(), iff.read_float(), iff.read_float())
-
-        if vertex_buffer_format.hasNormal(flags):
-            v.normal =  vector3D.Vector3D(iff.read_float(), iff.read_float(), iff.read_float())
-
-        if vertex_buffer_format.hasPointSize(flags):
-            point_size = iff.read_float() # unused
-
-        if vertex_buffer_format.hasColor0(flags):
-            v.color = iff.read_uint32()
-
-        if vertex_buffer_format.hasColor1(flags):
-            color1 = iff.read_uint32() # unused
-
-        for i in range(0, num_uv_sets):
-            dim = vertex_buffer_format.getTextureCoordinateSetDimension(flags, i)
-            v.texs.append([]) 
-            for j in range(0, dim):
-                v.texs[i].append(iff.read_float())
-
-        if skip_dot3:
-            iff.read_float()
-            iff.read_float()
-            iff.read_float()
-            iff.read_float()
-
-        return v
-
     def load(self):
-        iff = nsg_iff.IFF(filename=self.filename)
+        iff = nsg_iff.IFF(filename=self.filename, use_mmap=True)
         #print(f"Name: {iff.getCurrentName()} Length: {iff.getCurrentLength()}")
         iff.enterAnyForm()
         version = iff.getCurrentName()
 
         if version not in ["0005", "0004"]:
             print(f'Unsupported MESH version: {version}')
+            iff.close()
             return False
 
         iff.enterForm(version)
@@ -174,22 +290,14 @@ class SWGMesh(object):
             iff.enterForm("EXSP")
             iff.enterForm("0001")
             iff.enterChunk("SPHR")
-            x = iff.read_float()
-            y = iff.read_float()
-            z = iff.read_float()
-            rad = iff.read_float()
+            x, y, z, rad = iff.read_floats(4)
             #print(f"X: {x} Y: {y} Z: {z} Radius: {rad}")
             iff.exitChunk("SPHR")
             iff.exitForm("0001")
             iff.exitForm("EXSP")
 
             iff.enterChunk("BOX ")    
-            maxx = iff.read_float()
-            maxy = iff.read_float()
-            maxz = iff.read_float()
-            minx = iff.read_float()
-            miny = iff.read_float()
-            minz = iff.read_float()
+            maxx, maxy, maxz, minx, miny, minz = iff.read_floats(6)
             #print(f"MaxX: {maxx} MaxY: {maxy} MaxZ: {maxz} MinX: {minx} MinY: {miny} MinZ: {minz}")
             self.extents.append([maxx, maxy, maxz])
             self.extents.append([minx, miny, minz])
@@ -206,26 +314,15 @@ class SWGMesh(object):
             # else:
             col_data_length = iff.getCurrentLength() + 8
             col_form_name = iff.getCurrentName()
-            self.collision = iff.read_misc(col_data_length)
+            self.collision = bytes(iff.read_misc(col_data_length))
             print(f"Collision form: {col_form_name} Len: {col_data_length}")
 
             #hardpoints
             iff.enterForm("HPTS", True, False)
             while iff.enterChunk("HPNT", True):
-                rotXx = iff.read_float()
-                rotXy = iff.read_float()
-                rotXz = iff.read_float()
-                posX = iff.read_float()
-                rotYx = iff.read_float()
-                rotYy = iff.read_float()
-                rotYz = iff.read_float()
-                posY = iff.read_float()
-                rotZx = iff.read_float()
-                rotZy = iff.read_float()
-                rotZz = iff.read_float()
-                posZ = iff.read_float()
+                hpnt = iff.read_floats(12)
                 hpntName = iff.read_string()
-                self.hardpoints.append([rotXx, rotXy, rotXz, posX, rotYx, rotYy, rotYz, posY, rotZx, rotZy, rotZz, posZ, hpntName])
+                self.hardpoints.append(hpnt + [hpntName])
                 iff.exitChunk("HPNT")
             iff.exitForm("HPTS")
 
@@ -274,13 +371,11 @@ class SWGMesh(object):
                 bit_flag = iff.read_int32()
                 self.debug_flags(bit_flag, sps_no)
                 num_verts = iff.read_uint32()
-                verts = [None] * num_verts
                 iff.exitChunk("INFO")
 
+                # one record array per SPS, see vertex_buffer_format.VertexLayout for the fields
                 iff.enterChunk("DATA")
-                for i in range(0, num_verts):
-                    verts[i] = self.read_vertex(bit_flag, iff)
-
+                verts = iff.read_array(vertex_buffer_format.compileLayout(bit_flag).dtype, num_verts)
                 iff.exitChunk("DATA")
                 iff.exitForm("0003")
 
@@ -292,17 +387,13 @@ class SWGMesh(object):
                 index_count = iff.read_uint32()
                 bpi = (size - 4) // index_count
                 #print(f'Size: {size} Size - 4: {size - 4}, index_count: {index_count} bpi: {bpi}')
-                for i in range(index_count//3):
-                    tri = Triangle()
-                    if(bpi == 2):
-                        tri.p1 = iff.read_int16()
-                        tri.p2 = iff.read_int16()
-                        tri.p3 = iff.read_int16()
-                    elif(bpi == 4):
-                        tri.p1 = iff.read_int32()
-                        tri.p2 = iff.read_int32()
-                        tri.p3 = iff.read_int32()
-                    indexes.append(tri)
+                if(bpi == 2):
+                    flat = iff.read_uint16s(index_count - index_count % 3)
+                elif(bpi == 4):
+                    flat = iff.read_int32s(index_count - index_count % 3)
+                else:
+                    flat = []
+                indexes = [Triangle(p1, p2, p3) for p1, p2, p3 in zip(flat[0::3], flat[1::3], flat[2::3])]
                 #print(f'Read Index Count: {index_count}')
 
                 iff.exitChunk("INDX")
@@ -318,10 +409,45 @@ class SWGMesh(object):
                 
             iff.exitForm()
 
+        iff.close()
         return True
             
-    def write(self, filename):
-        iff = nsg_iff.IFF(initial_size=10000)
+    def optimize_vertex_cache(self, cache_size = vertex_cache.CACHE_SIZE):
+        for sps in self.spss:
+            before, after = sps.optimize_vertex_cache(cache_size)
+            print(f"SPS {sps.no} Shader: {sps.shader}: ACMR {before:.3f} -> {after:.3f}")
+
+    def pack_spss(self, split_large = True):
+        # [(shader, layout, vertex records, (T,3) indices), ...] ready to write. With split_large an
+        # SPS whose triangles use indices 16 bits can't hold becomes several SPS blocks of the
+        # same shader, each with its own remapped vertex buffer, and one with more vertices than
+        # 16 bits address but only low indices in use loses the unreferenced tail
+        blocks = []
+        for sps in self.spss:
+            # sps.verts is a record array (as loaded), a {field: array} mapping or SWGVertex list
+            layout = vertex_buffer_format.compileLayout(sps.flags or DEFAULT_SPS_FLAGS)
+            verts = sps.verts
+            num_verts = len(next(iter(verts.values()), [])) if isinstance(verts, dict) else len(verts)
+            if not hasattr(verts, 'dtype') and not isinstance(verts, dict):
+                verts = vertex_fields(verts, layout)
+            verts = layout.records(verts, num_verts)
+            tris = numpy.array(flat_indices(sps.tris), dtype=numpy.int64).reshape(-1, 3)
+            if not split_large or num_verts <= MAX_VERTS_16:
+                blocks.append((sps.shader, layout, verts, tris))
+                continue
+            if len(tris) == 0 or tris.max() < MAX_VERTS_16:
+                used = int(tris.max()) + 1 if len(tris) > 0 else 0
+                print(f"SPS {sps.no} Shader: {sps.shader} has {num_verts} verts, triangles use {used}, trimmed")
+                blocks.append((sps.shader, layout, verts[:used], tris))
+                continue
+            runs = split_indices(tris)
+            print(f"SPS {sps.no} Shader: {sps.shader} has {num_verts} verts, split into {len(runs)} SPS blocks")
+            for ids, local in runs:
+                blocks.append((sps.shader, layout, verts if ids is None else verts[ids], local))
+        return blocks
+
+    def write(self, filename, split_large = True):
+        iff = nsg_iff.IFFWriter()
         # - BEGIN MESH        
         iff.insertForm("MESH")
         iff.insertForm("0005")
@@ -392,17 +518,18 @@ class SWGMesh(object):
         iff.insertForm("SPS ")
         iff.insertForm("0001")
 
+        blocks = self.pack_spss(split_large)
+
         # --- BEGIN CNT
         iff.insertChunk("CNT ")
-        iff.insert_uint32(len(self.spss))
+        iff.insert_uint32(len(blocks))
         iff.exitChunk("CNT ")
 
-        for i in range(0, len(self.spss)):
-            sps = self.spss[i]
+        for i, (shader, layout, verts, indices) in enumerate(blocks):
             #print(f'Adding SPS {str(i+1).zfill(4)}')
             iff.insertNumberedForm(i+1)
             iff.insertChunk("NAME")
-            iff.insertChunkString(sps.shader)
+            iff.insertChunkString(shader)
             iff.exitChunk("NAME")
             iff.insertChunk("INFO")
             iff.insert_uint32(1) #"Shader primitive count" - Never seen anything other than 1
@@ -417,27 +544,23 @@ class SWGMesh(object):
             iff.insertForm("VTXA")
             iff.insertForm("0003")
             iff.insertChunk("INFO")
-            iff.insert_uint32(4357)
-            iff.insert_uint32(len(sps.verts))
+            iff.insert_uint32(layout.flags)
+            iff.insert_uint32(len(verts))
             iff.exitChunk("INFO")
             iff.insertChunk("DATA")
-            for v in sps.verts:
-                iff.insertFloatVector3((v.pos.x, v.pos.y, v.pos.z))
-                iff.insertFloatVector3((v.normal.x, v.normal.y, v.normal.z))
-                if len(v.texs) > 0 and (len(v.texs[0]) > 0):
-                    iff.insertFloatVector2((v.texs[0][0], v.texs[0][1]))
-                else:                    
-                    iff.insertFloatVector2((0,0))
+            iff.insertChunkData(verts.tobytes())
             iff.exitChunk("DATA")
             iff.exitForm("0003")
             iff.exitForm("VTXA")
 
+            # load() tells the width apart by the chunk size, so the narrowest one that fits the
+            # largest index is used
             iff.insertChunk("INDX")
-            iff.insert_uint32(len(sps.tris)*3)
-            for t in sps.tris:
-                iff.insert_uint16(t.p1)
-                iff.insert_uint16(t.p2)
-                iff.insert_uint16(t.p3)
+            iff.insert_uint32(indices.size)
+            if indices.size == 0 or indices.max() < MAX_VERTS_16:
+                iff.insertUint16Array(indices.reshape(-1))
+            else:
+                iff.insertUint32Array(indices.reshape(-1))
             iff.exitChunk("INDX")
 
             iff.exitForm("0001")
@@ -451,14 +574,30 @@ class SWGMesh(object):
         iff.write(filename)
 
 class SWGBLendShape(object):
+    # Sparse blend target: index arrays into the mesh's POSN / NORM / DOT3 pools plus a float32 (K,3)
+    # delta for each. dot3_indices/dot3_deltas are None when the blend has no DOT3 chunk
     def __init__(self):
         self.name = ""
-        self.positions = []
-        self.normals = []
-        self.dot3 = None
+        self.position_indices = numpy.zeros(0, dtype=numpy.int32)
+        self.position_deltas = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.normal_indices = numpy.zeros(0, dtype=numpy.int32)
+        self.normal_deltas = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.dot3_indices = None
+        self.dot3_deltas = None
+
+    @staticmethod
+    def from_pairs(name, positions, normals, dot3 = None):
+        # positions/normals/dot3 as lists of (index, (x, y, z))
+        blt = SWGBLendShape()
+        blt.name = name
+        blt.position_indices, blt.position_deltas = blend_arrays(positions)
+        blt.normal_indices, blt.normal_deltas = blend_arrays(normals)
+        if dot3 is not None:
+            blt.dot3_indices, blt.dot3_deltas = blend_arrays(dot3)
+        return blt
 
     def __str__(self):
-        return f"""Name: {self.name} Positions: {str(len(self.positions))} Norms: {str(len(self.normals))} DOT3: {(str(len(self.dot3)) if self.dot3 else "N/A")}"""
+        return f"""Name: {self.name} Positions: {str(len(self.position_indices))} Norms: {str(len(self.normal_indices))} DOT3: {(str(len(self.dot3_indices)) if self.dot3_indices is not None else "N/A")}"""
 
     def __repr__(self):
         return self.__str__()
@@ -479,7 +618,7 @@ class SWGPerShaderData(object):
             self.prims = []
 
     def __str__(self):
-        s = f"""Name: {self.name} pidx: {str(len(self.pidx))} nidx: {str(len(self.nidx))} DOT3: {(str(len(self.dot3)) if self.dot3 else "N/A")}"""
+        s = f"""Name: {self.name} pidx: {str(len(self.pidx))} nidx: {str(len(self.nidx))} DOT3: {(str(len(self.dot3)) if self.dot3 is not None else "N/A")}"""
         s += "\n"
         s += f"""UVS: {self.num_uvs} -- {', '.join( ("UVs: " + str(len(x)) + " Dim: " + str(len(x[0]))) for x in self.uvs)}"""
         s += "\n"
@@ -489,13 +628,256 @@ class SWGPerShaderData(object):
     def __repr__(self):
         return self.__str__()
 
+    def optimize_vertex_cache(self, cache_size = vertex_cache.CACHE_SIZE):
+        # reorder each primitive's triangles for the post-transform cache, then pidx/nidx/dot3/
+        # colors/uvs into the order the triangles first use them. Returns ACMR before and after
+        num_verts = len(self.pidx)
+        self.prims, old_ids, before, after = optimize_triangle_lists(self.prims, num_verts, cache_size)
+        self.pidx = reorder(self.pidx, old_ids)
+        self.nidx = reorder(self.nidx, old_ids)
+        if self.dot3 is not None and len(self.dot3) == num_verts:
+            self.dot3 = reorder(self.dot3, old_ids)
+        if self.colors is not None and len(self.colors) == num_verts:
+            self.colors = reorder(self.colors, old_ids)
+        self.uvs = [reorder(uv_set, old_ids) for uv_set in self.uvs]
+        return before, after
+
+    def weld(self, normals, tangents, epsilon, blends = ()):
+        # merge the vertices whose position index matches and whose normal, uv and tangent (looked up
+        # in the NORM/DOT3 pools by nidx/dot3) agree to within epsilon (exactly if 0), as do the
+        # NORM/DOT3 deltas every blend gives them. Survivors keep their first use order. Returns the
+        # vertex count before and after
+        loops = numpy.array(self.nidx, dtype=numpy.int64)
+        columns = [blend_columns(normals, [(blend.normal_indices, blend.normal_deltas) for blend in blends])[loops]]
+        columns += [numpy.asarray(uv_set, dtype=numpy.float64).reshape(len(loops), -1) for uv_set in self.uvs]
+        if tangents is not None and self.dot3 is not None and len(self.dot3) > 0:
+            dot3_blends = [(blend.dot3_indices, blend.dot3_deltas) for blend in blends if blend.dot3_indices is not None]
+            columns.append(blend_columns(tangents, dot3_blends)[numpy.array(self.dot3, dtype=numpy.int64)])
+        attributes = numpy.hstack(columns)
+        if epsilon > 0:
+            attributes = numpy.round(attributes / epsilon)
+        keep, new_ids = pool_rows(numpy.hstack((numpy.array(self.pidx, dtype=numpy.float64)[:, None], attributes)))
+
+        self.pidx = reorder(self.pidx, keep)
+        self.nidx = reorder(self.nidx, keep)
+        if self.dot3 is not None and len(self.dot3) > 0:
+            self.dot3 = reorder(self.dot3, keep)
+        self.uvs = [reorder(uv_set, keep) for uv_set in self.uvs]
+        self.prims = [remap_indices(flat_indices(prim), new_ids) for prim in self.prims]
+        return len(loops), len(keep)
+
+    def subset(self, tris):
+        # new PSDT with this one's shader holding just tris ((T,3) local indices), with only the
+        # vertices they use, in first use order
+        flat = numpy.asarray(tris, dtype=numpy.int64).reshape(-1)
+        _, first = numpy.unique(flat, return_index=True)
+        used = flat[numpy.sort(first)]
+        new_ids = numpy.zeros(len(self.pidx), dtype=numpy.int64)
+        new_ids[used] = numpy.arange(len(used))
+        psdt = SWGPerShaderData()
+        psdt.name = self.name
+        psdt.pidx = reorder(self.pidx, used)
+        psdt.nidx = reorder(self.nidx, used)
+        if self.dot3 is not None and len(self.dot3) == len(self.pidx):
+            psdt.dot3 = reorder(self.dot3, used)
+        if self.colors is not None and len(self.colors) == len(self.pidx):
+            psdt.colors = reorder(self.colors, used)
+        psdt.num_uvs = self.num_uvs
+        psdt.uv_dimensions = list(self.uv_dimensions)
+        psdt.uvs = [reorder(uv_set, used) for uv_set in self.uvs]
+        psdt.num_prims = 1
+        psdt.prims = [new_ids[flat].reshape(-1, 3)]
+        return psdt
+
+    def split_by_palette(self, vertex_bones, limit):
+        # cluster the triangles into groups touching at most limit distinct bones. vertex_bones holds
+        # the bone set of every mesh vertex. Triangles with the same bone set always go together; a
+        # cluster is seeded with the first unassigned set and grown greedily by the set adding the
+        # fewest new bones, preferring sets that share vertices with it, until nothing else fits.
+        # A set over the limit on its own gets a cluster to itself. Returns [(PSDT, palette size), ...]
+        tris = numpy.concatenate([numpy.array(flat_indices(prim), dtype=numpy.int64).reshape(-1, 3) for prim in self.prims]) if self.prims else numpy.zeros((0, 3), dtype=numpy.int64)
+        pidx = numpy.asarray(self.pidx, dtype=numpy.int64)[tris].tolist()
+
+        # triangles, bones and mesh vertices of every distinct bone set, in first use order
+        set_ids = {}
+        sets = []
+        for t, (a, b, c) in enumerate(pidx):
+            bones = vertex_bones[a] | vertex_bones[b] | vertex_bones[c]
+            if bones not in set_ids:
+                set_ids[bones] = len(sets)
+                sets.append((bones, [], set()))
+            sets[set_ids[bones]][1].append(t)
+            sets[set_ids[bones]][2].update((a, b, c))
+        palette = frozenset().union(*(bones for bones, _, _ in sets))
+        if len(palette) <= limit:
+            return [(self, len(palette))]
+
+        vertex_sets = collections.defaultdict(set)
+        for i, (_, _, verts) in enumerate(sets):
+            for v in verts:
+                vertex_sets[v].add(i)
+
+        unassigned = set(range(len(sets)))
+        clusters = []
+        while unassigned:
+            seed = min(unassigned)
+            unassigned.discard(seed)
+            palette = set(sets[seed][0])
+            members = [seed]
+            neighbours = set()
+            while len(palette) <= limit:
+                for v in sets[members[-1]][2]:
+                    neighbours |= vertex_sets[v]
+                fits = [i for i in unassigned if len(palette | sets[i][0]) <= limit]
+                if not fits:
+                    break
+                best = min(fits, key=lambda i: (len(sets[i][0] - palette), i not in neighbours, i))
+                unassigned.discard(best)
+                palette |= sets[best][0]
+                members.append(best)
+            clusters.append((sorted(t for i in members for t in sets[i][1]), len(palette)))
+        if len(clusters) == 1:
+            return [(self, clusters[0][1])]
+        return [(self.subset(tris[cluster]), size) for cluster, size in clusters]
+
     def stripped_shader_name(self):
         if self.name == "":
             return "defaultappearance"
         else:
             return self.name.split('/')[1].split('.')[0]
 
+class SWGSkinWeights(object):
+    # Compressed sparse row vertex weights, the same layout as TWHD/TWDT: the influences
+    # of vertex v are bones[offsets[v]:offsets[v+1]] with weights[offsets[v]:offsets[v+1]]
+    __slots__ = ('offsets', 'bones', 'weights')
+    def __init__(self, offsets, bones, weights):
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.bones = numpy.asarray(bones, dtype=numpy.uint32)
+        self.weights = numpy.asarray(weights, dtype=numpy.float32)
+
+    @staticmethod
+    def from_counts(counts, bones, weights):
+        offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        return SWGSkinWeights(offsets, bones, weights)
+
+    @staticmethod
+    def from_twdt(counts, twdt):
+        # counts from TWHD, twdt a TWDT_DTYPE record array
+        return SWGSkinWeights.from_counts(counts, twdt['bone'], twdt['weight'])
+
+    @staticmethod
+    def from_vertex_lists(vertex_weights):
+        # [[bone, weight], ...] per vertex
+        counts = [len(v) for v in vertex_weights]
+        bones = [w[0] for v in vertex_weights for w in v]
+        weights = [w[1] for v in vertex_weights for w in v]
+        return SWGSkinWeights.from_counts(counts, bones, weights)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __str__(self):
+        return f'Vertices: {len(self)} Influences: {len(self.bones)} Max per vertex: {self.max_influences()}'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def counts(self):
+        return numpy.diff(self.offsets)
+
+    def vertex_ids(self):
+        # owning vertex of every influence
+        return numpy.repeat(numpy.arange(len(self)), self.counts())
+
+    def sums(self):
+        return numpy.bincount(self.vertex_ids(), weights=self.weights, minlength=len(self))
+
+    def normalize(self, tolerance = 1e-5):
+        # rescale vertices whose weights don't add up to 1 (within tolerance). Returns how many changed
+        sums = self.sums()
+        off = (numpy.abs(sums - 1.0) > tolerance) & (sums > 0)
+        if off.any():
+            scale = numpy.ones(len(self))
+            scale[off] = 1.0 / sums[off]
+            self.weights = (self.weights * scale[self.vertex_ids()]).astype(numpy.float32)
+        return int(off.sum())
+
+    def limit(self, max_influences = 4, threshold = 0.0):
+        # keep each vertex's max_influences biggest weights (0 = no limit), heaviest first, dropping
+        # those under threshold but never a vertex's biggest one. Returns how many were dropped
+        vertex_ids = self.vertex_ids()
+        order = numpy.lexsort((-self.weights, vertex_ids))
+        rank = numpy.arange(len(order)) - numpy.repeat(self.offsets[:-1], self.counts())
+        keep = (rank == 0) | (self.weights[order] >= threshold)
+        if max_influences > 0:
+            keep &= rank < max_influences
+        kept = order[keep]
+        counts = numpy.bincount(vertex_ids[kept], minlength=len(self))
+        self.offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=self.offsets[1:])
+        self.bones = self.bones[kept]
+        self.weights = self.weights[kept]
+        return len(order) - len(kept)
+
+    def cap_sums(self):
+        # cut each influence down so the running total of its vertex never goes past 1, in file
+        # order, and drop nothing. Returns how many influences were capped
+        weights = self.weights.astype(numpy.float64)
+        running = numpy.cumsum(weights)
+        starts = self.offsets[:-1][self.counts() > 0]
+        before = numpy.repeat(running[starts] - weights[starts], self.counts()[self.counts() > 0])
+        prior = running - weights - before
+        capped = numpy.minimum(weights, numpy.maximum(1.0 - prior, 0.0))
+        changed = int((capped < weights).sum())
+        self.weights = capped.astype(numpy.float32)
+        return changed
+
+    def weight_groups(self, step = 1e-4):
+        # (bone, weight, vertex indices) for every run of influences with the same bone and the same
+        # weight once rounded to step, so each can be applied with a single VertexGroup.add
+        vertex_ids = self.vertex_ids()
+        levels = numpy.round(self.weights.astype(numpy.float64) / step).astype(numpy.int64)
+        order = numpy.lexsort((vertex_ids, levels, self.bones))
+        bones = self.bones[order]
+        levels = levels[order]
+        splits = numpy.flatnonzero((bones[1:] != bones[:-1]) | (levels[1:] != levels[:-1])) + 1
+        for group in numpy.split(numpy.arange(len(order)), splits):
+            if len(group) > 0:
+                yield int(bones[group[0]]), float(levels[group[0]] * step), vertex_ids[order[group]].tolist()
+
+    def bone_influences(self, bone):
+        # (vertex indices, weights) of every vertex influenced by bone
+        mask = self.bones == bone
+        return self.vertex_ids()[mask], self.weights[mask]
+
+    def max_influences(self):
+        return int(self.counts().max()) if len(self) > 0 else 0
+
+    def influence_histogram(self):
+        # number of vertices with 0, 1, 2, ... influences
+        return numpy.bincount(self.counts())
+
+    def vertex(self, v):
+        return [[int(b), float(w)] for b, w in zip(self.bones[self.offsets[v]:self.offsets[v+1]], self.weights[self.offsets[v]:self.offsets[v+1]])]
+
+    def to_vertex_lists(self):
+        bones = self.bones.tolist()
+        weights = self.weights.tolist()
+        offsets = self.offsets.tolist()
+        return [[[bones[i], weights[i]] for i in range(offsets[v], offsets[v+1])] for v in range(len(self))]
+
+    def to_twdt(self):
+        twdt = numpy.empty(len(self.bones), dtype=TWDT_DTYPE)
+        twdt['bone'] = self.bones
+        twdt['weight'] = self.weights
+        return twdt
+
 class SWGMgn(object):
+    # Parts of the file load() can be limited to. INFO is always read. PSDT_NAME
+    # reads just the shader name of each PSDT and skips its geometry
+    SECTIONS = ("SKTM", "XFNM", "POSN", "TWHD", "TWDT", "NORM", "DOT3", "BLTS", "OZN", "ZTO", "PSDT", "PSDT_NAME")
+
     def __init__(self, filename):
         self.filename = filename
 
@@ -526,6 +908,8 @@ class SWGMgn(object):
         self.twhd = []
         self.twdt = []
 
+        # SWGSkinWeights. When set, write() emits TWHD/TWDT from it instead of twdt
+        self.weights = None
         self.vertex_weights = []
 
         self.blends = []
@@ -550,9 +934,8 @@ class SWGMgn(object):
                 self.skeletons: {",".join(self.skeletons)}
                 self.bone_names: {",".join(self.bone_names)}
                 self.positions: {len(self.positions)}
-                self.twhd: {len(self.twhd)}
-                self.twdt: {len(self.twdt)}
-                self.dot3: {(str(len(self.dot3)) if self.dot3 else "NA")}
+                self.weights: {str(self.weights)}
+                self.dot3: {(str(len(self.dot3)) if self.dot3 is not None else "NA")}
                 self.occlusions: {', '.join(str(x) for x in self.occlusions)}
                 """
         #s += "\n".join(str(x) for x in self.positions)
@@ -564,26 +947,28 @@ class SWGMgn(object):
     def __repr__(self):
         return self.__str__()
 
-    def normalize_vertex_weights(self, weights):
-        for i , posn in enumerate(weights):
-            total = 0
-            for weight in posn:
-                total += weight[1]
-
-            for weight in posn:
-                before = weight[1]
-                weight[1] = weight[1]/total 
-                if weight[1] != before:
-                    print(f"Vert {i} changed weight for bone {weight[0]} from {before} to {weight[1]}")
-        
-    def load(self):
-        iff = nsg_iff.IFF(filename=self.filename)
+    def load(self, sections = None, as_arrays = False):
+        # sections: iterable of SECTIONS names to decode, or None for everything.
+        # Anything not asked for is skipped over without reading its payload.
+        # as_arrays: decode geometry straight into numpy arrays instead of lists:
+        #   positions/normals float32 (N,3), dot3 float32 (N,4), PSDT pidx/nidx/dot3 int32 (N,),
+        #   PSDT uvs float32 (N,dim) per set, PSDT prims int32 (T,3) per primitive
+        if sections is not None:
+            sections = set(sections)
+            for name in sections - set(SWGMgn.SECTIONS):
+                print(f'Unknown MGN section: {name}')
+
+        def want(name):
+            return sections is None or name in sections
+
+        iff = nsg_iff.IFF(filename=self.filename, use_mmap=True)
         print(f"Name: {iff.getCurrentName()} Length: {iff.getCurrentLength()}")
         iff.enterAnyForm()
         version = iff.getCurrentName()
 
         if version not in ["0004",]:
             print(f'Unsupported MGN version: {version}')
+            iff.close()
             return False
         
         print(f'Doing Mgn version: {version}')
@@ -611,82 +996,69 @@ class SWGMgn(object):
         iff.exitChunk("INFO")
         
         iff.enterChunk("SKTM")
-        while not iff.atEndOfForm():
+        while want("SKTM") and not iff.atEndOfForm():
             self.skeletons.append(iff.read_string())
         iff.exitChunk("SKTM")
         
         iff.enterChunk("XFNM")
-        while not iff.atEndOfForm():
+        while want("XFNM") and not iff.atEndOfForm():
             self.bone_names.append(iff.read_string())
         iff.exitChunk("XFNM")
 
         iff.enterChunk("POSN")  
-        self.positions = [0] * self.num_positions
-        i=0      
-        while not iff.atEndOfForm():
-            self.positions[i] = (iff.read_float(), iff.read_float(), -iff.read_float())
-            i += 1
+        if want("POSN") and as_arrays:
+            self.positions = iff.read_vec3s(as_numpy=True)
+            self.positions[:, 2] *= -1
+        elif want("POSN"):
+            self.positions = [(x, y, -z) for x, y, z in iff.read_vec3s()]
         iff.exitChunk("POSN")
 
-        self.twhd = [0] * self.num_positions
-        i = 0
         iff.enterChunk("TWHD")        
-        while not iff.atEndOfForm():
-            self.twhd[i] = iff.read_uint32()
-            i += 1
+        if want("TWHD"):
+            twhd = iff.read_uint32s(as_numpy=True)
         iff.exitChunk("TWHD")
 
         iff.enterChunk("TWDT")     
-        self.twdt = [[0,0.0]] * self.num_transform_weight_data   
-        i = 0
-        while not iff.atEndOfForm():
-            self.twdt[i] = [iff.read_uint32(), iff.read_float()]
-            #print(f'Twdt: {i} ({str(self.twdt[i])})')
-            i += 1
+        if want("TWDT"):
+            twdt = iff.read_array(TWDT_DTYPE)
+            self.weights = SWGSkinWeights.from_twdt(twhd, twdt) if want("TWHD") else None
         iff.exitChunk("TWDT")
 
-        i = 0
-        p = 0
-        self.vertex_weights = [None] * self.num_positions
-        for p, h in enumerate(self.twhd):
-            these_weights = []
-            sum=0
-            for x in range(0,h):
-                twdt = self.twdt[i]
-                sum += twdt[1]
-                these_weights.append(twdt)
-                i += 1
-            
-            # if sum != 1.0:
-            #     print(f' *** WARN ***: Vertex Weight sum for vert: {p} != 1.0 : {sum}')
-            self.vertex_weights[p] = these_weights
-        
-        self.normalize_vertex_weights(self.vertex_weights)
+        if self.weights is not None:
+            changed = self.weights.normalize()
+            if changed > 0:
+                print(f"Normalized weights of {changed} vertices")
+            if not as_arrays:
+                self.vertex_weights = self.weights.to_vertex_lists()
+                self.twhd = self.weights.counts().tolist()
+                self.twdt = self.vertex_weights
 
         #self.positions = list(zip(self.positions, self.vertex_weights))
 
         iff.enterChunk("NORM")     
-        self.normals = [None] * self.num_normals   
-        i = 0
-        while not iff.atEndOfForm():
-            self.normals[i] = (iff.read_float(), iff.read_float(), iff.read_float())
-            i += 1
+        if want("NORM"):
+            self.normals = iff.read_vec3s(as_numpy=as_arrays)
         iff.exitChunk("NORM")
 
         if iff.getCurrentName() == "DOT3":
             iff.enterChunk("DOT3")     
-            num_dot3 = iff.read_uint32()
-            self.dot3 = [None] * num_dot3   
-            i = 0
-            while not iff.atEndOfForm():
-                self.dot3[i] = [iff.read_float(), iff.read_float(), iff.read_float(), iff.read_float()]
-                i += 1
+            if want("DOT3"):
+                num_dot3 = iff.read_uint32()
+                dot3 = iff.read_floats(as_numpy=as_arrays)
+                if as_arrays:
+                    self.dot3 = dot3.reshape(-1, 4)
+                else:
+                    self.dot3 = [dot3[i:i+4] for i in range(0, len(dot3), 4)]
             iff.exitChunk("DOT3")
 
         if iff.getCurrentName() == "HPTS":
             iff.enterForm("HPTS")
             iff.exitForm("HPTS")
 
+        if iff.getCurrentName() == "BLTS" and not want("BLTS"):
+            iff.enterForm("BLTS")
+            iff.exitForm("BLTS")
+
         if iff.getCurrentName() == "BLTS":
             iff.enterForm("BLTS")
             while not iff.atEndOfForm():
@@ -700,22 +1072,23 @@ class SWGMgn(object):
                 self.blends.append(blt)
 
                 iff.enterChunk("POSN")
-                while not iff.atEndOfForm():
-                    blt.positions.append( (iff.read_uint32(), (iff.read_float(), iff.read_float(), iff.read_float())))
+                records = iff.read_array(BLT_DTYPE)
+                blt.position_indices = records['index'].astype(numpy.int32)
+                blt.position_deltas = records['delta']
                 iff.exitChunk("POSN")
 
                 iff.enterChunk("NORM")
-                while not iff.atEndOfForm():
-                    blt.normals.append( (iff.read_uint32(), (iff.read_float(), iff.read_float(), iff.read_float())))
+                records = iff.read_array(BLT_DTYPE)
+                blt.normal_indices = records['index'].astype(numpy.int32)
+                blt.normal_deltas = records['delta']
                 iff.exitChunk("NORM")
 
                 if iff.getCurrentName() == "DOT3":
                     iff.enterChunk("DOT3")     
                     num_dot3 = iff.read_int32()
-                    blt.dot3 = []
-                    #for i in range(0, num_dot3):
-                    while not iff.atEndOfForm():
-                        blt.dot3.append([(iff.read_int32(), (iff.read_float(), iff.read_float(), iff.read_float()))])
+                    records = iff.read_array(BLT_DTYPE)
+                    blt.dot3_indices = records['index'].astype(numpy.int32)
+                    blt.dot3_deltas = records['delta']
                     iff.exitChunk("DOT3")
 
                 iff.exitForm("BLT ")
@@ -724,7 +1097,7 @@ class SWGMgn(object):
         if iff.getCurrentName() == "OZN ":
             iff.enterChunk("OZN ")
             i = 0
-            while not iff.atEndOfForm():
+            while want("OZN") and not iff.atEndOfForm():
                 self.occlusions.append([iff.read_string(), i, 1])
                 i += 1
             iff.exitChunk("OZN ")
@@ -739,19 +1112,28 @@ class SWGMgn(object):
 
         if iff.getCurrentName() == "ZTO ":
             iff.enterChunk("ZTO ")
-            for occ in self.occlusions:
-                occ[2] = 0
-            while not iff.atEndOfForm():
-                index = iff.read_int16()
-                print(f"Found ZTO: {index}")
+            if want("ZTO"):
                 for occ in self.occlusions:
-                    if occ[1] == index:
-                        occ[2] = 1
-                        print(f"Occ: {str(occ)} is ZTO: {index} Setting occluded to: {occ[2]}")
+                    occ[2] = 0
+                while not iff.atEndOfForm():
+                    index = iff.read_int16()
+                    print(f"Found ZTO: {index}")
+                    for occ in self.occlusions:
+                        if occ[1] == index:
+                            occ[2] = 1
+                            print(f"Occ: {str(occ)} is ZTO: {index} Setting occluded to: {occ[2]}")
             iff.exitChunk("ZTO ")
 
-        while not iff.atEndOfForm():
-            if iff.getCurrentName() == "PSDT":
+        while (want("PSDT") or want("PSDT_NAME")) and not iff.atEndOfForm():
+            if iff.getCurrentName() == "PSDT" and not want("PSDT"):
+                psdt = SWGPerShaderData()
+                iff.enterForm("PSDT")
+                iff.enterChunk("NAME")
+                psdt.name = iff.read_string()
+                iff.exitChunk("NAME")
+                self.psdts.append(psdt)
+                iff.exitForm("PSDT")
+            elif iff.getCurrentName() == "PSDT":
                 psdt = SWGPerShaderData()
                 iff.enterForm("PSDT")
 
@@ -761,29 +1143,26 @@ class SWGMgn(object):
 
                 iff.enterChunk("PIDX")
                 num = iff.read_uint32()
-                while not iff.atEndOfForm():
-                    i = iff.read_uint32()
-                    psdt.pidx.append(i)
-
+                psdt.pidx = iff.read_int32s(as_numpy=True) if as_arrays else iff.read_uint32s()
                 iff.exitChunk("PIDX")
 
                 iff.enterChunk("NIDX")
-                while not iff.atEndOfForm():
-                    psdt.nidx.append(iff.read_uint32())
+                psdt.nidx = iff.read_int32s(as_numpy=True) if as_arrays else iff.read_uint32s()
                 iff.exitChunk("NIDX")
 
                 if iff.getCurrentName() == "DOT3":
-                    psdt.dot3 = []
                     iff.enterChunk("DOT3")
-                    while not iff.atEndOfForm():
-                        psdt.dot3.append(iff.read_uint32())
+                    psdt.dot3 = iff.read_int32s(as_numpy=True) if as_arrays else iff.read_uint32s()
                     iff.exitChunk("DOT3")
 
                 if iff.getCurrentName() == "VDCL":
-                    psdt.colors = []
                     iff.enterChunk("VDCL")
-                    while not iff.atEndOfForm():
-                        psdt.colors.append([iff.read_byte(), iff.read_byte(), iff.read_byte(), iff.read_byte()])
+                    if as_arrays:
+                        psdt.colors = iff.read_array(numpy.uint8).reshape(-1, 4)
+                    else:
+                        psdt.colors = []
+                        while not iff.atEndOfForm():
+                            psdt.colors.append([iff.read_byte(), iff.read_byte(), iff.read_byte(), iff.read_byte()])
                     iff.exitChunk("VDCL")
 
                 if iff.getCurrentName() == "TXCI":
@@ -798,13 +1177,12 @@ class SWGMgn(object):
                     while not iff.atEndOfForm(): 
                         dim = psdt.uv_dimensions[i]
                         num = iff.getCurrentLength() // 4 // dim             
-                        psdt.uvs.append([None] * num)                 
                         iff.enterChunk("TCSD")
-                        for n in range(0, num):
-                            uv = []
-                            for m in range(0, dim):
-                                uv.append(iff.read_float())
-                            psdt.uvs[i][n] = uv
+                        uvs = iff.read_floats(num * dim, as_numpy=as_arrays)
+                        if as_arrays:
+                            psdt.uvs.append(uvs.reshape(-1, dim))
+                        else:
+                            psdt.uvs.append([uvs[n:n+dim] for n in range(0, len(uvs), dim)])
                         iff.exitChunk("TCSD")                    
                         i += 1
                     iff.exitForm("TCSF")
@@ -818,25 +1196,21 @@ class SWGMgn(object):
                     iff.enterChunk(prim_type)
 
                     triangle_list = []
-                    if prim_type == "OITL":
+                    if prim_type == "OITL" and as_arrays:
                         num_tris = iff.read_uint32()
-                        #for n in range(0, num_tris):
-                        while not iff.atEndOfForm():
-                            occ = iff.read_int16()
-                            p1 = iff.read_int32()
-                            p2 = iff.read_int32()
-                            p3 = iff.read_int32()
-                            tri = Triangle(p1, p2, p3)
-                            triangle_list.append(tri)
+                        psdt.prims.append(iff.read_array(OITL_DTYPE)['tri'].astype(numpy.int32))
+                    elif prim_type == "OITL":
+                        num_tris = iff.read_uint32()
+                        for occ, p1, p2, p3 in struct.iter_unpack('<h3i', iff.read_chunk_view()):
+                            triangle_list.append(Triangle(p1, p2, p3))
                         psdt.prims.append(triangle_list)
+                    elif prim_type == "ITL " and as_arrays:
+                        num_tris = iff.read_uint32()
+                        psdt.prims.append(iff.read_int32s(num_tris * 3, as_numpy=True).reshape(-1, 3))
                     elif prim_type == "ITL ":
                         num_tris = iff.read_uint32()
-                        for n in range(0, num_tris):
-                            p1 = iff.read_int32()
-                            p2 = iff.read_int32()
-                            p3 = iff.read_int32()
-                            tri = Triangle(p1, p2, p3)
-                            triangle_list.append(tri)
+                        flat = iff.read_int32s(num_tris * 3)
+                        triangle_list = [Triangle(p1, p2, p3) for p1, p2, p3 in zip(flat[0::3], flat[1::3], flat[2::3])]
                         psdt.prims.append(triangle_list)
                     else:
                         print(f'Unhandled PRIM type: {prim_type}')
@@ -848,7 +1222,96 @@ class SWGMgn(object):
             else:
                 print(f'Unexpected form: {iff.getCurrentName()}')
                 iff.exitForm()
-        print(self)
+        iff.close()
+        return True
+
+    def update_transform_counts(self):
+        # INFO's most influences on one vertex and most distinct bones used by one PSDT, from weights
+        weights = self.weights if self.weights is not None else SWGSkinWeights.from_vertex_lists(self.twdt)
+        self.max_transforms_vertex = weights.max_influences()
+        self.max_transforms_shader = 0
+        for psdt in self.psdts:
+            pidx = numpy.asarray(psdt.pidx, dtype=numpy.int64)
+            verts = numpy.zeros(len(weights), dtype=bool)
+            verts[pidx[pidx < len(weights)]] = True
+            bones = numpy.unique(weights.bones[verts[weights.vertex_ids()]])
+            self.max_transforms_shader = max(self.max_transforms_shader, len(bones))
+        return self.max_transforms_vertex, self.max_transforms_shader
+
+    def split_palettes(self, limit):
+        # split every PSDT that references more than limit bones into several with the same shader
+        weights = self.weights if self.weights is not None else SWGSkinWeights.from_vertex_lists(self.twdt)
+        bones = weights.bones.tolist()
+        offsets = weights.offsets.tolist()
+        vertex_bones = [frozenset(bones[offsets[v]:offsets[v+1]]) for v in range(len(weights))]
+        vertex_bones += [frozenset()] * (len(self.positions) - len(vertex_bones))
+        psdts = []
+        for psdt in self.psdts:
+            parts = psdt.split_by_palette(vertex_bones, limit)
+            print(f"PSDT {psdt.name}: palette sizes {[size for _, size in parts]}")
+            psdts += [part for part, _ in parts]
+        self.psdts = psdts
+
+    def pool_vectors(self, tolerance = 0.0):
+        # collapse duplicate NORM and DOT3 entries and point PSDT NIDX/DOT3 and the blends at the
+        # pooled ones. Entries only count as duplicates if every blend moves them the same way too.
+        # Returns ((normals before, after), (dot3 before, after))
+        sizes = []
+        keep, remap = pool_rows(blend_columns(self.normals, [(blend.normal_indices, blend.normal_deltas) for blend in self.blends]), tolerance)
+        sizes.append((len(self.normals), len(keep)))
+        self.normals = reorder(self.normals, keep)
+        for psdt in self.psdts:
+            psdt.nidx = remap_indices(psdt.nidx, remap)
+        for blend in self.blends:
+            blend.normal_indices, blend.normal_deltas = remap_blend(blend.normal_indices, blend.normal_deltas, remap, tolerance)
+
+        if self.dot3 is not None and len(self.dot3) > 0:
+            dot3_blends = [(blend.dot3_indices, blend.dot3_deltas) for blend in self.blends if blend.dot3_indices is not None]
+            keep, remap = pool_rows(blend_columns(self.dot3, dot3_blends), tolerance)
+            sizes.append((len(self.dot3), len(keep)))
+            self.dot3 = reorder(self.dot3, keep)
+            for psdt in self.psdts:
+                if psdt.dot3 is not None and len(psdt.dot3) > 0:
+                    psdt.dot3 = remap_indices(psdt.dot3, remap)
+            for blend in self.blends:
+                if blend.dot3_indices is not None:
+                    blend.dot3_indices, blend.dot3_deltas = remap_blend(blend.dot3_indices, blend.dot3_deltas, remap, tolerance)
+        else:
+            sizes.append((0, 0))
+        return tuple(sizes)
+
+    def optimize_vertex_cache(self, cache_size = vertex_cache.CACHE_SIZE):
+        for psdt in self.psdts:
+            before, after = psdt.optimize_vertex_cache(cache_size)
+            print(f"PSDT {psdt.name}: ACMR {before:.3f} -> {after:.3f}")
+
+    def evaluate_blends(self, blend_weights):
+        # Deformed (positions, normals) for a weighted mix of blends, e.g. the body shape
+        # sliders: {"fat": 0.5, "muscle": 0.25}. Blends not named get weight 0. Results are
+        # float32 (N,3) in the same space as self.positions / self.normals, with normals renormalized
+        positions = numpy.array(self.positions, dtype=numpy.float32).reshape(-1, 3)
+        normals = numpy.array(self.normals, dtype=numpy.float32).reshape(-1, 3)
+
+        used = [(b, blend_weights[b.name]) for b in self.blends if blend_weights.get(b.name, 0) != 0]
+        if not used:
+            return positions, normals
+
+        position_indices = numpy.concatenate([b.position_indices for b, w in used])
+        position_deltas = numpy.concatenate([b.position_deltas * w for b, w in used])
+        # blend deltas are stored in file space; load() flips z on positions
+        position_deltas[:, 2] *= -1
+        numpy.add.at(positions, position_indices, position_deltas)
+
+        normal_indices = numpy.concatenate([b.normal_indices for b, w in used])
+        normal_deltas = numpy.concatenate([b.normal_deltas * w for b, w in used])
+        if len(normal_indices) > 0:
+            numpy.add.at(normals, normal_indices, normal_deltas)
+            touched = numpy.unique(normal_indices)
+            lengths = numpy.linalg.norm(normals[touched], axis=1)
+            lengths[lengths == 0] = 1
+            normals[touched] /= lengths[:, None]
+
+        return positions, normals
 
     def get_zones_this_occludes(self):
         i = 0
@@ -858,26 +1321,29 @@ class SWGMgn(object):
         return i
 
     def write(self):
-        iff = nsg_iff.IFF(initial_size=10000)
-        print(f"Name: {iff.getCurrentName()} Length: {iff.getCurrentLength()}")
+        weights = self.weights if self.weights is not None else SWGSkinWeights.from_vertex_lists(self.twdt)
+
+        iff = nsg_iff.IFFWriter()
         iff.insertForm("SKMG")
         iff.insertForm("0004")
 
         iff.insertChunk("INFO")
-        iff.insert_uint32(self.max_transforms_vertex)
-        iff.insert_uint32(self.max_transforms_shader)
-        iff.insert_uint32(len(self.skeletons))
-        iff.insert_uint32(len(self.bone_names))
-        iff.insert_uint32(len(self.positions))
-        iff.insert_uint32(len([vv for v in self.twdt for vv in v ]))
-        iff.insert_uint32(len(self.normals))
-        iff.insert_uint32(len(self.psdts))
-        iff.insert_uint32(len(self.blends))
+        iff.insertUint32Array([
+            self.max_transforms_vertex,
+            self.max_transforms_shader,
+            len(self.skeletons),
+            len(self.bone_names),
+            len(self.positions),
+            len(weights.bones),
+            len(self.normals),
+            len(self.psdts),
+            len(self.blends)])
         
-        iff.insert_uint16(len(self.occlusions))
-        iff.insert_uint16(self.num_occ_combo_zones)
-        iff.insert_uint16(self.get_zones_this_occludes())
-        iff.insert_uint16(self.occlusion_layer) 
+        iff.insertUint16Array([
+            len(self.occlusions),
+            self.num_occ_combo_zones,
+            self.get_zones_this_occludes(),
+            self.occlusion_layer])
         iff.exitChunk("INFO")
         
         iff.insertChunk("SKTM")
@@ -891,33 +1357,25 @@ class SWGMgn(object):
         iff.exitChunk("XFNM")
 
         iff.insertChunk("POSN")
-        for pos in self.positions:
-            #pos[0] = -pos[0]
-            iff.insertFloatVector3(pos)
+        iff.insertVec3Array(self.positions)
         iff.exitChunk("POSN")
 
         iff.insertChunk("TWHD")
-        for twdt in self.twdt:
-            iff.insert_uint32(len(twdt))
+        iff.insertUint32Array(weights.counts())
         iff.exitChunk("TWHD")
         
         iff.insertChunk("TWDT")
-        for twdt in self.twdt:
-            for weight in twdt:
-                iff.insert_uint32(weight[0])
-                iff.insertFloat(weight[1])
+        iff.insertChunkData(weights.to_twdt().tobytes())
         iff.exitChunk("TWDT")
 
         iff.insertChunk("NORM")
-        for norm in self.normals:
-            iff.insertFloatVector3(norm)
+        iff.insertVec3Array(self.normals)
         iff.exitChunk("NORM") 
 
-        if self.dot3:
+        if self.dot3 is not None and len(self.dot3) > 0:
             iff.insertChunk("DOT3")
             iff.insert_uint32(len(self.dot3))
-            for dot3 in self.dot3:
-                iff.insertFloatVector4(dot3)
+            iff.insertVec4Array(self.dot3)
             iff.exitChunk("DOT3")
 
 
@@ -931,29 +1389,23 @@ class SWGMgn(object):
                 iff.insertForm("BLT ")
 
                 iff.insertChunk("INFO")
-                iff.insert_uint32(len(blend.positions))
-                iff.insert_uint32(len(blend.normals))
+                iff.insert_uint32(len(blend.position_indices))
+                iff.insert_uint32(len(blend.normal_indices))
                 iff.insertChunkString(blend.name)
                 iff.exitChunk("INFO")
 
                 iff.insertChunk("POSN")
-                for p in blend.positions:
-                    iff.insert_uint32(p[0])
-                    iff.insertFloatVector3(p[1])
+                iff.insertChunkData(blend_records(blend.position_indices, blend.position_deltas).tobytes())
                 iff.exitChunk("POSN")
 
                 iff.insertChunk("NORM")
-                for n in blend.normals:
-                    iff.insert_uint32(n[0])
-                    iff.insertFloatVector3(n[1])
+                iff.insertChunkData(blend_records(blend.normal_indices, blend.normal_deltas).tobytes())
                 iff.exitChunk("NORM")
 
-                if blend.dot3:
+                if blend.dot3_indices is not None and len(blend.dot3_indices) > 0:
                     iff.insertChunk("DOT3")
-                    iff.insert_uint32(len(blend.dot3))
-                    for n in blend.dot3:
-                        iff.insert_uint32(n[0])
-                        iff.insertFloatVector3(n[1])
+                    iff.insert_uint32(len(blend.dot3_indices))
+                    iff.insertChunkData(blend_records(blend.dot3_indices, blend.dot3_deltas).tobytes())
                     iff.exitChunk("DOT3")
 
                 iff.exitForm("BLT ")
@@ -975,9 +1427,7 @@ class SWGMgn(object):
 
         if len(self.occlusions) > 0:
             iff.insertChunk("ZTO ")
-            for occ in self.occlusions:
-                if occ[2] == 1:
-                    iff.insert_int16(occ[1])
+            iff.insertInt16Array([occ[1] for occ in self.occlusions if occ[2] == 1])
             iff.exitChunk("ZTO ")
 
         for psdt in self.psdts:
@@ -988,34 +1438,29 @@ class SWGMgn(object):
 
             iff.insertChunk("PIDX")
             iff.insert_uint32(len(psdt.pidx))
-            for pidx in psdt.pidx:
-                iff.insert_uint32(pidx)
+            iff.insertUint32Array(psdt.pidx)
             iff.exitChunk("PIDX")
 
             iff.insertChunk("NIDX")
-            for nidx in psdt.nidx:
-                iff.insert_uint32(nidx)
+            iff.insertUint32Array(psdt.nidx)
             iff.exitChunk("NIDX")
 
-            if psdt.dot3:
+            if psdt.dot3 is not None and len(psdt.dot3) > 0:
                 iff.insertChunk("DOT3")
-                for dot3 in psdt.dot3:
-                    iff.insert_uint32(dot3)
+                iff.insertUint32Array(psdt.dot3)
                 iff.exitChunk("DOT3")
 
             if len(psdt.uvs) > 0:
+                uv_sets = [numpy.array(uv_set, dtype=numpy.float64).reshape(len(uv_set), -1) for uv_set in psdt.uvs]
                 iff.insertChunk("TXCI")
-                iff.insert_int32(len(psdt.uvs))
-                for uv_set in psdt.uvs:
-                    iff.insert_int32(len(uv_set[0]))
+                iff.insertInt32Array([len(uv_sets)] + [uv_set.shape[1] for uv_set in uv_sets])
                 iff.exitChunk("TXCI")
 
                 iff.insertForm("TCSF")
-                for uv_set in psdt.uvs:
+                for uv_set in uv_sets:
+                    uv_set[:, 1] = 1 - uv_set[:, 1]
                     iff.insertChunk("TCSD")
-                    for uv in uv_set:
-                        iff.insertFloat(uv[0])
-                        iff.insertFloat(1 - uv[1]) 
+                    iff.insertFloatArray(uv_set)
                     iff.exitChunk("TCSD")
                 iff.exitForm("TCSF")
 
@@ -1026,10 +1471,10 @@ class SWGMgn(object):
             iff.exitChunk("INFO")
 
             for prim in psdt.prims:
+                indices = flat_indices(prim)
                 iff.insertChunk("ITL ")
-                iff.insert_uint32(len(prim) // 3)
-                for value in prim:
-                    iff.insert_uint32(value)
+                iff.insert_uint32(len(indices) // 3)
+                iff.insertUint32Array(indices)
                 iff.exitChunk("ITL ")
             iff.exitForm("PRIM")
             
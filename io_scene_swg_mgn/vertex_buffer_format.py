@@ -20,6 +20,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import functools
+import numpy
+
 TextureCoordinateSetCountShift = 8
 TextureCoordinateSetCountMask = 15
 
@@ -169,3 +172,69 @@ def setTextureCoordinateSetDimension(flags, textureCoordinateSet, dimension):
     shift = (TextureCoordinateSetDimensionBaseShift + (textureCoordinateSet * TextureCoordinateSetDimensionPerSetShift))
     flags = (flags & ~((TextureCoordinateSetDimensionMask) << shift)) | ((dimension - TextureCoordinateSetDimensionAdjustment) << shift)
     return flags
+
+class VertexLayout(object):
+    # Record layout of one VTXA vertex for a given bit_flag. fields is a list of
+    # (name, offset, numpy format, count) in file order; dtype is the matching packed
+    # numpy record type.
+    # Field names: position, normal, point_size, color0, color1, uv0..uvN, dot3
+    __slots__ = ('flags', 'fields', 'stride', 'dtype', 'uv_dimensions', 'has_dot3')
+    def __init__(self, flags):
+        self.flags = flags
+        self.fields = []
+        self.uv_dimensions = []
+        self.has_dot3 = False
+
+        num_uv_sets = getNumberOfTextureCoordinateSets(flags)
+        # a trailing 4D set is the deprecated DOT3 data, not a real UV set
+        if (num_uv_sets > 0) and (getTextureCoordinateSetDimension(flags, num_uv_sets - 1) == 4):
+            self.has_dot3 = True
+            num_uv_sets -= 1
+
+        offset = 0
+        def add(name, fmt, count):
+            nonlocal offset
+            self.fields.append((name, offset, fmt, count))
+            offset += numpy.dtype(fmt).itemsize * count
+
+        if hasPosition(flags):
+            add('position', '<f4', 3)
+        if hasNormal(flags):
+            add('normal', '<f4', 3)
+        if hasPointSize(flags):
+            add('point_size', '<f4', 1)
+        if hasColor0(flags):
+            add('color0', '<u4', 1)
+        if hasColor1(flags):
+            add('color1', '<u4', 1)
+        for i in range(0, num_uv_sets):
+            dim = getTextureCoordinateSetDimension(flags, i)
+            self.uv_dimensions.append(dim)
+            add(f'uv{i}', '<f4', dim)
+        if self.has_dot3:
+            add('dot3', '<f4', 4)
+
+        self.stride = offset
+        self.dtype = numpy.dtype([(name, fmt) if count == 1 else (name, fmt, (count,)) for name, _, fmt, count in self.fields])
+
+    def __str__(self):
+        return f'Flags: {self.flags} Stride: {self.stride} Fields: {", ".join(f[0] for f in self.fields)}'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def records(self, vertices, count = None):
+        # record array of self.dtype from a record array or a mapping of field name -> per vertex
+        # array; fields are matched by name and missing ones left as 0
+        names = vertices.dtype.names if hasattr(vertices, 'dtype') else vertices.keys()
+        if count is None:
+            count = len(vertices) if hasattr(vertices, 'dtype') else max((len(vertices[n]) for n in names), default=0)
+        data = numpy.zeros(count, dtype=self.dtype)
+        for name in self.dtype.names:
+            if name in names:
+                data[name] = numpy.asarray(vertices[name]).reshape(data[name].shape)
+        return data
+
+@functools.lru_cache(maxsize=None)
+def compileLayout(flags):
+    return VertexLayout(int(flags))
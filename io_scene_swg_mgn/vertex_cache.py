@@ -0,0 +1,137 @@
+# MIT License
+#
+# Copyright (c) 2022 Nick Rafalski
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Post-transform vertex cache optimisation of triangle lists, after Tom Forsyth's
+# "Linear-Speed Vertex Cache Optimisation". All triangle arguments are (T,3) index arrays.
+
+import collections
+import numpy
+
+CACHE_SIZE = 32
+
+# Forsyth's tuning values
+CACHE_DECAY_POWER = 1.5
+LAST_TRI_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+def acmr(tris, cache_size = CACHE_SIZE):
+    # average cache miss ratio (vertex transforms per triangle) through a FIFO cache of cache_size
+    tris = numpy.asarray(tris).reshape(-1, 3)
+    if len(tris) == 0:
+        return 0.0
+    cache = collections.deque(maxlen=cache_size)
+    cached = set()
+    misses = 0
+    for v in tris.reshape(-1).tolist():
+        if v not in cached:
+            misses += 1
+            if len(cache) == cache_size:
+                cached.discard(cache[0])
+            cache.append(v)
+            cached.add(v)
+    return misses / len(tris)
+
+def _vertex_score(position, remaining, cache_size):
+    if remaining == 0:
+        return -1.0
+    score = 0.0
+    if position >= 0:
+        if position < 3:
+            score = LAST_TRI_SCORE
+        else:
+            score = (1.0 - (position - 3) / (cache_size - 3)) ** CACHE_DECAY_POWER
+    return score + VALENCE_BOOST_SCALE * remaining ** -VALENCE_BOOST_POWER
+
+def optimize(tris, cache_size = CACHE_SIZE):
+    # triangle order (permutation of range(T)) with good post-transform cache reuse
+    tris = numpy.asarray(tris, dtype=numpy.int64).reshape(-1, 3)
+    num_tris = len(tris)
+    if num_tris == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    tri_verts = tris.tolist()
+    num_verts = int(tris.max()) + 1
+
+    # active triangles of every vertex
+    by_vertex = numpy.argsort(tris.reshape(-1), kind='stable') // 3
+    counts = numpy.bincount(tris.reshape(-1), minlength=num_verts)
+    offsets = numpy.concatenate(([0], numpy.cumsum(counts))).tolist()
+    by_vertex = by_vertex.tolist()
+    active = [by_vertex[offsets[v]:offsets[v+1]] for v in range(num_verts)]
+
+    remaining = counts.tolist()
+    position = [-1] * num_verts
+    score = [_vertex_score(-1, n, cache_size) for n in remaining]
+    tri_score = [score[a] + score[b] + score[c] for a, b, c in tri_verts]
+    emitted = [False] * num_tris
+
+    order = []
+    cache = []
+    best = max(range(num_tris), key=tri_score.__getitem__)
+    cursor = 0
+    while len(order) < num_tris:
+        if best < 0:
+            # nothing left touching the cache, take the next unemitted triangle
+            while emitted[cursor]:
+                cursor += 1
+            best = cursor
+        emitted[best] = True
+        order.append(best)
+
+        tri = tri_verts[best]
+        for v in tri:
+            remaining[v] -= 1
+            active[v].remove(best)
+        cache = tri + [v for v in cache if v not in tri]
+        evicted = cache[cache_size:]
+        cache = cache[:cache_size]
+        for v in evicted:
+            position[v] = -1
+            score[v] = _vertex_score(-1, remaining[v], cache_size)
+        for i, v in enumerate(cache):
+            position[v] = i
+            score[v] = _vertex_score(i, remaining[v], cache_size)
+
+        best = -1
+        best_score = -1.0
+        for v in cache + evicted:
+            for t in active[v]:
+                a, b, c = tri_verts[t]
+                s = score[a] + score[b] + score[c]
+                tri_score[t] = s
+                if s > best_score:
+                    best = t
+                    best_score = s
+    return numpy.array(order, dtype=numpy.int64)
+
+def fetch_order(tris, num_verts):
+    # vertices in first use order (unused ones last) and tris renumbered to match,
+    # so vertex data is read front to back as the triangles are drawn
+    tris = numpy.asarray(tris, dtype=numpy.int64).reshape(-1, 3)
+    flat = tris.reshape(-1)
+    _, first = numpy.unique(flat, return_index=True)
+    used = flat[numpy.sort(first)]
+    unused = numpy.setdiff1d(numpy.arange(num_verts), used)
+    old_ids = numpy.concatenate((used, unused)).astype(numpy.int64)
+    new_ids = numpy.empty(num_verts, dtype=numpy.int64)
+    new_ids[old_ids] = numpy.arange(num_verts)
+    return old_ids, new_ids[tris]
@@ -0,0 +1,12 @@
+# The add-on's __init__ registers Blender operators and needs bpy. The modules tested here only
+# need numpy, so the package is registered by path without running __init__.
+import pathlib
+import sys
+import types
+
+PACKAGE_DIR = pathlib.Path(__file__).resolve().parent.parent / "io_scene_swg_mgn"
+
+if "io_scene_swg_mgn" not in sys.modules:
+    package = types.ModuleType("io_scene_swg_mgn")
+    package.__path__ = [str(PACKAGE_DIR)]
+    sys.modules["io_scene_swg_mgn"] = package
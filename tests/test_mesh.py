@@ -0,0 +1,124 @@
+import numpy
+
+from io_scene_swg_mgn import nsg_iff, swg_types, vertex_buffer_format
+from io_scene_swg_mgn.swg_types import SPS, SWGMesh
+
+
+def mesh(num_verts, tris, flags=swg_types.DEFAULT_SPS_FLAGS):
+    layout = vertex_buffer_format.compileLayout(flags)
+    verts = numpy.zeros(num_verts, dtype=layout.dtype)
+    verts['position'] = numpy.arange(num_verts * 3, dtype=numpy.float32).reshape(-1, 3)
+    m = SWGMesh("unused.msh")
+    m.extents = [[1, 1, 1], [-1, -1, -1]]
+    m.spss.append(SPS("0001", "shader/test.sht", flags, verts, numpy.asarray(tris)))
+    return m
+
+
+def index_widths(path):
+    # bytes per index of every SPS's INDX chunk
+    iff = nsg_iff.IFF(filename=str(path))
+    index = iff.buildIndex()
+    widths = []
+    for sps in index.find("MESH/0005/SPS/0001").children[1:]:
+        indx = [c for c in sps.children[-1].children if c.name == "INDX"][0]
+        count = int.from_bytes(bytes(iff.data[indx.dataOffset():indx.dataOffset() + 4]), 'little')
+        widths.append((indx.dataLength() - 4) // count)
+    return widths
+
+
+def triangle_positions(m):
+    out = []
+    for sps in m.spss:
+        tris = numpy.asarray(swg_types.flat_indices(sps.tris)).reshape(-1, 3)
+        out.append(sps.verts['position'][tris])
+    return numpy.concatenate(out)
+
+
+def test_split_indices_leaves_small_lists_alone():
+    runs = swg_types.split_indices([[0, 1, 2], [2, 1, 3]], max_verts=4)
+    assert len(runs) == 1 and runs[0][0] is None
+
+
+def test_split_indices_caps_vertices_per_run():
+    tris = numpy.random.default_rng(0).integers(0, 100, (200, 3))
+    runs = swg_types.split_indices(tris, max_verts=32)
+    assert len(runs) > 1
+    rebuilt = numpy.concatenate([ids[local] for ids, local in runs])
+    assert numpy.array_equal(rebuilt, tris)
+    assert all(len(ids) <= 32 and local.max() < len(ids) for ids, local in runs)
+
+
+def test_small_sps_writes_16_bit_indices(tmp_path):
+    path = tmp_path / "small.msh"
+    mesh(4, [[0, 1, 2], [2, 1, 3]]).write(str(path))
+    assert index_widths(path) == [2]
+
+
+def test_large_sps_writes_32_bit_indices_when_not_split(tmp_path):
+    path = tmp_path / "large.msh"
+    m = mesh(70000, [[0, 1, 69999], [2, 3, 4]])
+    m.write(str(path), split_large=False)
+    assert index_widths(path) == [4]
+    loaded = SWGMesh(str(path))
+    loaded.load()
+    assert numpy.array_equal(triangle_positions(loaded), triangle_positions(m))
+
+
+def test_large_sps_with_low_indices_writes_16_bit_indices(tmp_path):
+    path = tmp_path / "low.msh"
+    m = mesh(70000, [[0, 1, 2], [3, 4, 5]])
+    m.write(str(path), split_large=False)
+    assert index_widths(path) == [2]
+    loaded = SWGMesh(str(path))
+    loaded.load()
+    assert len(loaded.spss[0].verts) == 70000
+
+    # splitting trims the vertices nothing references instead
+    m.write(str(path))
+    assert index_widths(path) == [2]
+    loaded = SWGMesh(str(path))
+    loaded.load()
+    assert len(loaded.spss) == 1 and len(loaded.spss[0].verts) == 6
+    assert numpy.array_equal(triangle_positions(loaded), triangle_positions(m))
+
+
+def test_large_sps_splits_into_16_bit_blocks(tmp_path):
+    path = tmp_path / "split.msh"
+    # enough triangles that the vertices they use can't fit one 16-bit block
+    tris = numpy.random.default_rng(1).integers(0, 70000, (100000, 3))
+    m = mesh(70000, tris)
+    m.write(str(path))
+    assert set(index_widths(path)) == {2}
+    loaded = SWGMesh(str(path))
+    loaded.load()
+    assert len(loaded.spss) > 1
+    assert all(len(sps.verts) <= swg_types.MAX_VERTS_16 for sps in loaded.spss)
+    assert numpy.array_equal(triangle_positions(loaded), triangle_positions(m))
+
+
+def test_vtxa_round_trips_every_field(tmp_path):
+    # color0, a 2D and a 3D UV set and the trailing DOT3 set
+    flags = vertex_buffer_format.setColor0(swg_types.DEFAULT_SPS_FLAGS, True)
+    flags = vertex_buffer_format.setNumberOfTextureCoordinateSets(flags, 3)
+    flags = vertex_buffer_format.setTextureCoordinateSetDimension(flags, 1, 3)
+    flags = vertex_buffer_format.setTextureCoordinateSetDimension(flags, 2, 4)
+    m = mesh(50, numpy.arange(48).reshape(-1, 3), flags)
+    rng = numpy.random.default_rng(2)
+    verts = m.spss[0].verts
+    for name in verts.dtype.names:
+        if name == 'color0':
+            verts[name] = rng.integers(0, 2**32, len(verts), dtype=numpy.uint32)
+        else:
+            verts[name] = rng.standard_normal(verts[name].shape)
+
+    path = tmp_path / "first.msh"
+    m.write(str(path))
+    loaded = SWGMesh(str(path))
+    loaded.load()
+    assert loaded.spss[0].flags == flags
+    assert loaded.spss[0].verts.dtype.names == ('position', 'normal', 'color0', 'uv0', 'uv1', 'dot3')
+    assert loaded.spss[0].verts.tobytes() == verts.tobytes()
+
+    again = tmp_path / "second.msh"
+    loaded.write(str(again))
+    assert again.read_bytes() == path.read_bytes()
@@ -0,0 +1,89 @@
+import numpy
+
+from io_scene_swg_mgn.swg_types import SWGBLendShape, SWGMgn, SWGPerShaderData, SWGSkinWeights, flat_indices
+
+
+def sample(path):
+    # a quad with two zones, one of them occluded, a blend and two UV sets
+    mgn = SWGMgn(str(path))
+    mgn.skeletons = ["appearance/skeleton/all_b.skt"]
+    mgn.bone_names = ["root", "spine"]
+    mgn.positions = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (1.0, 1.0, 0.0), (0.0, 1.0, 0.5)]
+    mgn.normals = [(0.0, 0.0, 1.0), (0.0, 1.0, 0.0)]
+    mgn.dot3 = [(1.0, 0.0, 0.0, 1.0), (0.0, 1.0, 0.0, -1.0)]
+    mgn.weights = SWGSkinWeights.from_vertex_lists([[[0, 1.0]], [[0, .5], [1, .5]], [[1, 1.0]], [[1, 1.0]]])
+    mgn.blends = [SWGBLendShape.from_pairs("fat", [(1, (0.5, 0.0, 0.25))], [(0, (0.0, 0.5, 0.0))], [(1, (0.25, 0.0, 0.0))])]
+    mgn.occlusions = [["head", 0, 1], ["chest", 1, 0]]
+    psdt = SWGPerShaderData()
+    psdt.name = "test"
+    psdt.pidx = [0, 1, 2, 3]
+    psdt.nidx = [0, 0, 1, 1]
+    psdt.dot3 = [0, 1, 0, 1]
+    psdt.uvs = [[(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)], [(0.5, 0.5), (0.25, 0.5), (0.25, 0.25), (0.5, 0.25)]]
+    psdt.prims = [[0, 1, 2, 0, 2, 3]]
+    mgn.psdts = [psdt]
+    mgn.update_transform_counts()
+    mgn.write()
+    return str(path)
+
+
+def loaded(path, **kwargs):
+    mgn = SWGMgn(path)
+    assert mgn.load(**kwargs)
+    return mgn
+
+
+def test_sections_read_only_what_is_asked_for(tmp_path):
+    path = sample(tmp_path / "sample.mgn")
+    full = loaded(path)
+    mgn = loaded(path, sections=["POSN", "PSDT_NAME"])
+    assert mgn.positions == full.positions
+    assert mgn.num_positions == 4 and mgn.num_blends == 1
+    assert mgn.normals == [] and mgn.weights is None and mgn.blends == [] and mgn.occlusions == []
+    assert [p.name for p in mgn.psdts] == ["shader/test.sht"]
+    assert mgn.psdts[0].pidx == []
+
+
+def test_sections_keep_zone_flags_when_zto_is_skipped(tmp_path):
+    path = sample(tmp_path / "sample.mgn")
+    assert loaded(path).occlusions == [["head", 0, 1], ["chest", 1, 0]]
+    assert loaded(path, sections=["OZN", "ZTO"]).occlusions == [["head", 0, 1], ["chest", 1, 0]]
+    # without ZTO nothing is known about occlusion, so the flags keep OZN's default
+    assert loaded(path, sections=["OZN"]).occlusions == [["head", 0, 1], ["chest", 1, 1]]
+
+
+def test_arrays_match_lists(tmp_path):
+    path = sample(tmp_path / "sample.mgn")
+    lists = loaded(path)
+    arrays = loaded(path, as_arrays=True)
+    numpy.testing.assert_array_equal(arrays.positions, lists.positions)
+    numpy.testing.assert_array_equal(arrays.normals, lists.normals)
+    numpy.testing.assert_array_equal(arrays.dot3, lists.dot3)
+    assert arrays.weights.to_vertex_lists() == lists.vertex_weights
+    assert arrays.occlusions == lists.occlusions
+    assert len(arrays.psdts) == len(lists.psdts) == 1
+    for a, l in zip(arrays.psdts, lists.psdts):
+        assert a.name == l.name
+        for name in ("pidx", "nidx", "dot3"):
+            assert getattr(a, name).dtype == numpy.int32
+            assert getattr(a, name).tolist() == getattr(l, name)
+        assert len(a.uvs) == len(l.uvs) == 2
+        for a_uvs, l_uvs in zip(a.uvs, l.uvs):
+            numpy.testing.assert_array_equal(a_uvs, l_uvs)
+        assert [p.shape for p in a.prims] == [(2, 3)]
+        assert [p.reshape(-1).tolist() for p in a.prims] == [flat_indices(p) for p in l.prims]
+
+
+def test_evaluate_blends_applies_weighted_deltas(tmp_path):
+    mgn = loaded(sample(tmp_path / "sample.mgn"), as_arrays=True)
+    positions, normals = mgn.evaluate_blends({})
+    numpy.testing.assert_array_equal(positions, mgn.positions)
+    numpy.testing.assert_array_equal(normals, mgn.normals)
+
+    positions, normals = mgn.evaluate_blends({"fat": 0.5, "thin": 1.0})
+    expected = numpy.array(mgn.positions)
+    # the file's delta (0.5, 0, 0.25) is in file space, so z flips like load()'s positions
+    expected[1] += (0.25, 0.0, -0.125)
+    numpy.testing.assert_allclose(positions, expected, atol=1e-6)
+    numpy.testing.assert_allclose(normals[0], numpy.array([0.0, 0.25, 1.0]) / numpy.sqrt(1.0625), atol=1e-6)
+    numpy.testing.assert_array_equal(normals[1], mgn.normals[1])
@@ -0,0 +1,69 @@
+from io_scene_swg_mgn import nsg_iff
+
+
+def build(iff, close_root=True):
+    # nested forms, empty and sized chunks, and a form holding only a chunk
+    iff.insertForm("ROOT")
+    iff.insertForm("0001")
+    iff.insertChunk("INFO")
+    iff.insert_uint32(7)
+    iff.insertFloat(1.5)
+    iff.exitChunk("INFO")
+    iff.insertChunk("NAME")
+    iff.insertChunkString("shader/a.sht")
+    iff.exitChunk("NAME")
+    iff.insertChunk("EMPT")
+    iff.exitChunk("EMPT")
+    iff.exitForm("0001")
+    for i in range(3):
+        iff.insertForm("SPS ")
+        iff.insertChunk("DATA")
+        iff.insertChunkData(bytes([i]) * (i + 1))
+        iff.exitChunk("DATA")
+        iff.exitForm("SPS ")
+    if close_root:
+        iff.exitForm("ROOT")
+    return iff
+
+
+def written(iff, path):
+    iff.write(str(path))
+    return path.read_bytes()
+
+
+def test_writer_matches_original_iff(tmp_path):
+    original = written(build(nsg_iff.IFF()), tmp_path / "original.iff")
+    writer = written(build(nsg_iff.IFFWriter()), tmp_path / "writer.iff")
+    assert writer == original
+    assert int.from_bytes(original[4:8], 'big') == len(original) - 8
+
+
+def test_writer_patches_blocks_left_open(tmp_path):
+    original = written(build(nsg_iff.IFF()), tmp_path / "original.iff")
+    writer = written(build(nsg_iff.IFFWriter(), close_root=False), tmp_path / "writer.iff")
+    assert writer == original
+
+
+def test_index_path_lookup(tmp_path):
+    path = tmp_path / "lookup.iff"
+    build(nsg_iff.IFFWriter()).write(str(path))
+    index = nsg_iff.IFF(filename=str(path)).buildIndex()
+
+    info = index.find("ROOT/0001/INFO")
+    assert info.tag == "INFO" and info.dataLength() == 8
+    # trailing spaces in form names are optional and [n] picks among siblings
+    assert len(index.findAll("ROOT/SPS")) == 3
+    assert index.find("ROOT/SPS /DATA").dataLength() == 1
+    assert index.find("ROOT/SPS[2]/DATA").dataLength() == 3
+    assert index.find("ROOT/SPS[3]") is None
+    assert index.find("ROOT/MISS") is None
+    assert index.find("ROOT/0001/EMPT").dataLength() == 0
+
+    reader = index.open("ROOT/0001/INFO")
+    reader.enterChunk("INFO")
+    assert reader.read_uint32() == 7
+    assert reader.read_float() == 1.5
+    reader = index.open(index.find("ROOT/0001/NAME"))
+    reader.enterChunk("NAME")
+    assert reader.read_string() == "shader/a.sht"
+    assert index.open("ROOT/NOPE") is None
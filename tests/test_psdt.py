@@ -0,0 +1,182 @@
+import numpy
+import pytest
+
+from io_scene_swg_mgn import swg_types
+from io_scene_swg_mgn.swg_types import SWGBLendShape, SWGMgn, SWGPerShaderData, SWGSkinWeights
+
+
+def psdt(pidx, prims, nidx=None, uvs=None):
+    p = SWGPerShaderData()
+    p.name = "shader/test.sht"
+    p.pidx = list(pidx)
+    p.nidx = list(nidx if nidx is not None else range(len(pidx)))
+    p.uvs = [uvs if uvs is not None else [(0.0, 0.0)] * len(pidx)]
+    p.prims = [prims]
+    return p
+
+
+def corners(mgn, p):
+    # (position, normal, uv) of every triangle corner, in triangle order
+    tris = numpy.array(swg_types.flat_indices(p.prims[0])).reshape(-1, 3)
+    positions = numpy.asarray(mgn.positions)[numpy.asarray(p.pidx)[tris]]
+    normals = numpy.asarray(mgn.normals)[numpy.asarray(p.nidx)[tris]]
+    uvs = numpy.asarray(p.uvs[0])[tris]
+    return numpy.concatenate((positions, normals, uvs), axis=2)
+
+
+def blended_normals(mgn, p, blend):
+    # every PSDT vertex's normal with the blend fully applied
+    deltas = numpy.zeros((len(mgn.normals), 3))
+    deltas[blend.normal_indices] = blend.normal_deltas
+    nidx = numpy.asarray(p.nidx)
+    return numpy.asarray(mgn.normals)[nidx] + deltas[nidx]
+
+
+def test_weld_merges_matching_corners():
+    # a quad as two triangles with one PSDT vertex per corner; corner 3 matches corner 0 within epsilon
+    normals = [[0, 0, 1]] * 6
+    normals[3] = [0, 0, 1.00001]
+    p = psdt([0, 1, 2, 0, 2, 3], [2, 1, 0, 5, 4, 3], uvs=[(0, 0), (1, 0), (1, 1), (0, 0), (1, 1), (0, 1)])
+    p.dot3 = list(range(6))
+    assert p.weld(normals, [[1, 0, 0, 1]] * 6, 0.0001) == (6, 4)
+    assert p.pidx == [0, 1, 2, 3]
+    assert p.nidx == [0, 1, 2, 5]
+    assert p.uvs == [[(0, 0), (1, 0), (1, 1), (0, 1)]]
+    assert p.prims == [[2, 1, 0, 3, 2, 0]]
+
+
+def test_weld_keeps_corners_with_different_uvs():
+    p = psdt([0, 0], [0, 1, 1], uvs=[(0, 0), (0.5, 0)])
+    assert p.weld([[0, 0, 1]] * 2, None, 0.0001) == (2, 2)
+
+
+def quad():
+    return psdt([0, 1, 2, 0, 2, 3], [2, 1, 0, 5, 4, 3], uvs=[(0, 0), (1, 0), (1, 1), (0, 0), (1, 1), (0, 1)])
+
+
+def test_weld_keeps_corners_blends_move_differently():
+    # corners 0 and 3 share a position, normal and uv, but only corner 0's normal moves
+    p = quad()
+    blend = SWGBLendShape.from_pairs("blend", [], [(0, (0.5, 0, 0))], [(0, (0, 0.5, 0))])
+    p.dot3 = list(range(6))
+    assert p.weld([[0, 0, 1]] * 6, [[1, 0, 0, 1]] * 6, 0.0001, [blend]) == (6, 5)
+    assert p.nidx == [0, 1, 2, 3, 5]
+
+
+def test_weld_merges_corners_blends_move_alike():
+    p = quad()
+    blend = SWGBLendShape.from_pairs("blend", [], [(0, (0.5, 0, 0)), (3, (0.5, 0, 0))])
+    assert p.weld([[0, 0, 1]] * 6, None, 0.0001, [blend]) == (6, 4)
+    assert p.nidx == [0, 1, 2, 5]
+
+
+def test_split_by_palette_limits_bones_per_psdt():
+    mgn = SWGMgn("unused.mgn")
+    mgn.positions = numpy.zeros((6, 3))
+    mgn.normals = numpy.zeros((6, 3))
+    mgn.weights = SWGSkinWeights.from_vertex_lists([[[v, 1.0]] for v in range(6)])
+    p = psdt(range(6), [0, 1, 2, 0, 1, 3, 3, 4, 5])
+    mgn.psdts = [p]
+    before = sorted(map(tuple, corners(mgn, p).reshape(-1, 24).tolist()))
+    mgn.split_palettes(3)
+    assert len(mgn.psdts) == 3
+    assert all(part.name == p.name for part in mgn.psdts)
+    assert mgn.update_transform_counts() == (1, 3)
+    after = sorted(map(tuple, numpy.concatenate([corners(mgn, part).reshape(-1, 24) for part in mgn.psdts]).tolist()))
+    assert after == before
+
+
+def test_split_by_palette_leaves_small_psdts_alone():
+    p = psdt(range(3), [0, 1, 2])
+    parts = p.split_by_palette([frozenset([0]), frozenset([1]), frozenset([1])], 4)
+    assert parts == [(p, 2)]
+
+
+def test_pool_vectors_merges_duplicate_rows():
+    mgn = SWGMgn("unused.mgn")
+    mgn.normals = [[0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.00001], [0.0, 1.0, 0.0]]
+    mgn.dot3 = [[1.0, 0.0, 0.0, 1.0], [1.0, 0.0, 0.0, -1.0], [1.0, 0.0, 0.0, 1.0], [1.0, 0.0, 0.0, 1.0]]
+    p = psdt(range(4), [0, 1, 2, 1, 2, 3])
+    p.dot3 = list(range(4))
+    mgn.psdts = [p]
+    base = numpy.asarray(mgn.normals)[numpy.asarray(p.nidx)]
+    assert mgn.pool_vectors(0.0001) == ((4, 2), (4, 2))
+    assert p.nidx == [0, 1, 0, 1]
+    assert p.dot3 == [0, 1, 0, 0]
+    numpy.testing.assert_allclose(numpy.asarray(mgn.normals)[numpy.asarray(p.nidx)], base, atol=1e-4)
+
+
+def test_pool_vectors_round_trips_blends():
+    mgn = SWGMgn("unused.mgn")
+    mgn.normals = [[0.0, 0.0, 1.0]] * 4
+    p = psdt(range(4), [0, 1, 2, 1, 2, 3])
+    mgn.psdts = [p]
+    blend = SWGBLendShape.from_pairs("blend", [], [(2, (0.5, 0, 0)), (3, (0.25, 0, 0))])
+    mgn.blends = [blend]
+    base = numpy.asarray(mgn.normals)[numpy.asarray(p.nidx)]
+    moved = blended_normals(mgn, p, blend)
+
+    assert mgn.pool_vectors(0.0001) == ((4, 3), (0, 0))
+    assert p.nidx == [0, 0, 1, 2]
+    numpy.testing.assert_allclose(numpy.asarray(mgn.normals)[numpy.asarray(p.nidx)], base)
+    numpy.testing.assert_allclose(blended_normals(mgn, p, blend), moved)
+
+
+def test_pool_vectors_merges_rows_moved_alike():
+    mgn = SWGMgn("unused.mgn")
+    mgn.normals = [[0.0, 0.0, 1.0]] * 4
+    p = psdt(range(4), [0, 1, 2, 1, 2, 3])
+    mgn.psdts = [p]
+    blend = SWGBLendShape.from_pairs("blend", [], [(2, (0.5, 0, 0)), (3, (0.5, 0, 0))])
+    mgn.blends = [blend]
+    moved = blended_normals(mgn, p, blend)
+    assert mgn.pool_vectors(0.0001)[0] == (4, 2)
+    assert blend.normal_indices.tolist() == [1]
+    numpy.testing.assert_allclose(blended_normals(mgn, p, blend), moved)
+
+
+def test_pool_vectors_handles_an_empty_mesh():
+    mgn = SWGMgn("unused.mgn")
+    mgn.dot3 = []
+    mgn.blends = [SWGBLendShape.from_pairs("blend", [], [])]
+    assert mgn.pool_vectors(0.0001) == ((0, 0), (0, 0))
+    assert swg_types.pool_rows(numpy.zeros((0, 3)))[0].tolist() == []
+    assert swg_types.blend_columns([], []).shape == (0, 0)
+
+
+def test_remap_blend_rejects_merging_different_deltas():
+    with pytest.raises(ValueError):
+        swg_types.remap_blend([2, 3], [[0.5, 0, 0], [0.25, 0, 0]], numpy.array([0, 0, 0, 0]))
+    with pytest.raises(ValueError):
+        # row 1 is untouched (0) but pools with the moved row 0
+        swg_types.remap_blend([0], [[0.5, 0, 0]], numpy.array([0, 0]))
+
+
+def test_remap_blend_rejects_out_of_range_indices():
+    with pytest.raises(ValueError):
+        swg_types.remap_blend([4], [[1, 0, 0]], numpy.array([0, 1, 2, 3]))
+
+
+def test_remap_blend_moves_consistent_deltas():
+    indices, deltas = swg_types.remap_blend([0, 1, 3], [[0.5, 0, 0]] * 3, numpy.array([0, 0, 1, 2]))
+    assert indices.tolist() == [0, 2]
+    numpy.testing.assert_allclose(deltas, [[0.5, 0, 0]] * 2)
+
+
+def test_split_by_palette_groups_interleaved_triangles():
+    # 40 triangles alternating between bones {0, 1} and {2, 3}
+    bones = [frozenset([0]), frozenset([1]), frozenset([2]), frozenset([3])]
+    vertex_bones = [bones[v % 4] for v in range(160)]
+    tris = [[4 * t, 4 * t + 1, 4 * t + 1] if t % 2 == 0 else [4 * t + 2, 4 * t + 3, 4 * t + 3] for t in range(40)]
+    p = psdt(range(160), numpy.array(tris).reshape(-1).tolist())
+    parts = p.split_by_palette(vertex_bones, 2)
+    assert [size for _, size in parts] == [2, 2]
+    assert [len(part.prims[0]) for part, _ in parts] == [20, 20]
+
+
+def test_split_by_palette_prefers_sets_sharing_vertices():
+    # after {0} the cheapest sets are {1} and {0, 2}; {0, 2} shares a vertex with the seed so goes first
+    vertex_bones = [frozenset([b]) for b in (0, 0, 0, 1, 1, 1, 2, 2)]
+    p = psdt(range(8), [0, 1, 2, 3, 4, 5, 2, 6, 7])
+    parts = p.split_by_palette(vertex_bones, 2)
+    assert [(sorted(part.pidx), size) for part, size in parts] == [([0, 1, 2, 6, 7], 2), ([3, 4, 5], 1)]
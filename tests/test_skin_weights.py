@@ -0,0 +1,57 @@
+import numpy
+
+from io_scene_swg_mgn.swg_types import SWGSkinWeights
+
+
+def weights(lists):
+    return SWGSkinWeights.from_vertex_lists(lists)
+
+
+def test_round_trips_vertex_lists_and_twdt():
+    lists = [[[3, .5], [1, .5]], [], [[0, 1.0]]]
+    w = weights(lists)
+    assert w.counts().tolist() == [2, 0, 1]
+    assert w.to_vertex_lists() == lists
+    again = SWGSkinWeights.from_twdt(w.counts(), w.to_twdt())
+    assert again.to_vertex_lists() == lists
+    assert w.bone_influences(1)[0].tolist() == [0]
+
+
+def test_limit_keeps_strongest_influences():
+    w = weights([[[0, .1], [1, .5], [2, .2], [3, .15], [4, .05]], [], [[0, .3], [1, .0005]]])
+    dropped = w.limit(max_influences=4, threshold=0.001)
+    assert dropped == 2
+    assert [[b for b, _ in v] for v in w.to_vertex_lists()] == [[1, 2, 3, 0], [], [0]]
+    assert w.max_influences() == 4
+
+
+def test_limit_never_drops_a_vertex_strongest_bone():
+    w = weights([[[2, .0001], [3, .00005]]])
+    w.limit(max_influences=4, threshold=0.001)
+    assert [b for b, _ in w.vertex(0)] == [2]
+
+
+def test_limit_zero_keeps_every_influence():
+    w = weights([[[b, .1] for b in range(8)]])
+    assert w.limit(max_influences=0) == 0
+    assert w.max_influences() == 8
+
+
+def test_normalize_rescales_only_off_vertices():
+    w = weights([[[0, .5], [1, .25]], [[0, 1.0]], []])
+    assert w.normalize() == 1
+    numpy.testing.assert_allclose(w.sums(), [1.0, 1.0, 0.0], atol=1e-6)
+    numpy.testing.assert_allclose(w.weights[:2], [2 / 3, 1 / 3], atol=1e-6)
+
+
+def test_cap_sums_caps_running_total():
+    w = weights([[[0, .7], [1, .5]], [], [[2, 1.2]], [[0, .3], [1, .3], [2, .3]]])
+    assert w.cap_sums() == 2
+    numpy.testing.assert_allclose(w.weights, [.7, .3, 1.0, .3, .3, .3], atol=1e-6)
+    assert (w.sums() <= 1.0 + 1e-6).all()
+
+
+def test_weight_groups_cover_every_influence():
+    w = weights([[[0, .5], [1, .5]], [[0, .5]], [[1, .25]]])
+    groups = list(w.weight_groups())
+    assert sorted((b, round(wt, 4), tuple(v)) for b, wt, v in groups) == [(0, .5, (0, 1)), (1, .25, (2,)), (1, .5, (0,))]
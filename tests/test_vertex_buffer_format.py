@@ -0,0 +1,37 @@
+import numpy
+
+from io_scene_swg_mgn import vertex_buffer_format as vbf
+
+
+def flags(color0=True, uv_dimensions=(2, 3), dot3=True):
+    f = vbf.setNormal(vbf.setPosition(0, True), True)
+    f = vbf.setColor0(f, color0)
+    dims = list(uv_dimensions) + ([4] if dot3 else [])
+    f = vbf.setNumberOfTextureCoordinateSets(f, len(dims))
+    for i, dim in enumerate(dims):
+        f = vbf.setTextureCoordinateSetDimension(f, i, dim)
+    return f
+
+
+def test_layout_follows_flags():
+    layout = vbf.compileLayout(flags())
+    assert [(name, offset, count) for name, offset, _, count in layout.fields] == [
+        ('position', 0, 3), ('normal', 12, 3), ('color0', 24, 1), ('uv0', 28, 2), ('uv1', 36, 3), ('dot3', 48, 4)]
+    assert layout.stride == layout.dtype.itemsize == 64
+    assert layout.uv_dimensions == [2, 3] and layout.has_dot3
+    assert vbf.compileLayout(flags()) is layout
+
+
+def test_layout_without_dot3():
+    layout = vbf.compileLayout(4357)
+    assert layout.dtype.names == ('position', 'normal', 'uv0')
+    assert layout.stride == 32 and not layout.has_dot3
+
+
+def test_records_fill_missing_fields_with_zero():
+    layout = vbf.compileLayout(flags())
+    data = layout.records({'position': [(1, 2, 3), (4, 5, 6)], 'uv1': [(0.5, 0.25, 1)] * 2})
+    assert data.dtype == layout.dtype and len(data) == 2
+    numpy.testing.assert_array_equal(data['position'], [(1, 2, 3), (4, 5, 6)])
+    numpy.testing.assert_array_equal(data['uv1'], [(0.5, 0.25, 1)] * 2)
+    assert not data['normal'].any() and not data['color0'].any() and not data['dot3'].any()
@@ -0,0 +1,34 @@
+import numpy
+
+from io_scene_swg_mgn import vertex_cache
+
+
+def grid(n):
+    tris = []
+    for y in range(n):
+        for x in range(n):
+            a = y * (n + 1) + x
+            tris += [(a, a + 1, a + n + 1), (a + 1, a + n + 2, a + n + 1)]
+    return numpy.array(tris)
+
+
+def test_acmr_counts_fifo_misses():
+    assert vertex_cache.acmr([]) == 0.0
+    assert vertex_cache.acmr([[0, 1, 2], [2, 1, 3]]) == 2.0
+    # a cache of 3 has evicted 0 by the time the third triangle needs it
+    assert vertex_cache.acmr([[0, 1, 2], [3, 4, 5], [0, 1, 2]], cache_size=3) == 3.0
+    assert vertex_cache.acmr([[0, 1, 2], [3, 4, 5], [0, 1, 2]], cache_size=6) == 2.0
+
+
+def test_optimize_is_a_permutation_that_lowers_acmr():
+    tris = grid(30)
+    tris = tris[numpy.random.default_rng(0).permutation(len(tris))]
+    order = vertex_cache.optimize(tris)
+    assert sorted(order.tolist()) == list(range(len(tris)))
+    assert vertex_cache.acmr(tris[order]) < vertex_cache.acmr(tris) / 2
+
+
+def test_fetch_order_renumbers_by_first_use():
+    old_ids, tris = vertex_cache.fetch_order([[4, 2, 0], [2, 4, 1]], 6)
+    assert old_ids.tolist() == [4, 2, 0, 1, 3, 5]
+    assert tris.tolist() == [[0, 1, 2], [1, 0, 3]]